@@ -3,15 +3,20 @@
 """
 
 import json
+import atexit
 import random
 import string
 from pathlib import Path
-from typing import Any, Union
+from queue import Empty, Queue
+from threading import Thread
+from itertools import count
+from typing import Any, Optional, Union
 
 import arrow
+import orjson
 
 
-__all__ = ("Debugger",)
+__all__ = ("Debugger", "CaptureLog")
 
 
 class Debugger:
@@ -80,4 +85,170 @@ class Debugger:
                 file.write(data)
         ok = file_name.is_file()
         self.log(f"[{ok}]save debug: {file_name}")
-        return ok
\ No newline at end of file
+        return ok
+
+
+class CaptureLog:
+    """Buffered debug capture into rotating jsonl files.
+
+    Records are serialized by orjson in caller thread, then batched and
+    written by a background thread, set sample=N to capture 1 in N records.
+    """
+
+    __slots__ = (
+        "path",
+        "name",
+        "sample",
+        "max_bytes",
+        "backups",
+        "batch",
+        "interval",
+        "_counter",
+        "_queue",
+        "_thread",
+    )
+
+    def __init__(
+        self,
+        path: Path,
+        name: str = "capture",
+        sample: int = 1,
+        max_bytes: int = 64 * 1024 * 1024,
+        backups: int = 5,
+        batch: int = 256,
+        interval: float = 1.0,
+    ) -> None:
+        """Init CaptureLog, start background writer thread."""
+        assert sample > 0 and max_bytes > 0 and batch > 0
+
+        self.path = path
+        self.name = name
+        self.sample = sample
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.batch = batch
+        self.interval = interval
+
+        self._counter = count(1)
+        self._queue: Queue[Optional[bytes]] = Queue()
+        self._thread = Thread(target=self._run, name=f"capture-{name}", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    @property
+    def file(self) -> Path:
+        """Current capture file path."""
+        return Path(self.path, f"{self.name}.jsonl")
+
+    def sampled(self) -> bool:
+        """Check if next record should be captured, 1 in `sample` records."""
+        return next(self._counter) % self.sample == 0
+
+    def add(self, record: Any) -> None:
+        """Serialize record and queue it for background writing."""
+        line = orjson.dumps(
+            record, default=str, option=orjson.OPT_APPEND_NEWLINE | orjson.OPT_NON_STR_KEYS
+        )
+        self._queue.put(line)
+
+    def flush(self) -> None:
+        """Block until all queued records been written."""
+        self._queue.join()
+
+    def close(self) -> None:
+        """Write remain records and stop background thread."""
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+
+    def rotate(self) -> None:
+        """Rotate capture files: `name.jsonl` -> `name.1.jsonl` -> ..."""
+        for index in range(self.backups - 1, 0, -1):
+            src = Path(self.path, f"{self.name}.{index}.jsonl")
+            if src.is_file():
+                src.replace(Path(self.path, f"{self.name}.{index + 1}.jsonl"))
+        if self.backups > 0:
+            self.file.replace(Path(self.path, f"{self.name}.1.jsonl"))
+        else:
+            self.file.unlink(missing_ok=True)
+
+    def _write(self, lines: list[bytes]) -> None:
+        """Write batch of lines, rotate file if oversize."""
+        self.path.mkdir(parents=True, exist_ok=True)
+        with open(self.file, "ab") as file:
+            file.write(b"".join(lines))
+            size = file.tell()
+        if size >= self.max_bytes:
+            self.rotate()
+
+    def _run(self) -> None:
+        """Background loop: collect lines into batches and write them."""
+        running = True
+        while running:
+            lines: list[bytes] = []
+            try:
+                line = self._queue.get(timeout=self.interval)
+                while True:
+                    if line is None:
+                        running = False
+                    else:
+                        lines.append(line)
+                    if not running or len(lines) >= self.batch:
+                        break
+                    line = self._queue.get_nowait()
+            except Empty:
+                pass
+            try:
+                if lines:
+                    self._write(lines)
+            except OSError:
+                # batch dropped, such as disk full, keep capturing the next
+                pass
+            finally:
+                for _ in range(len(lines) + (0 if running else 1)):
+                    self._queue.task_done()
+
+
+class TestCaptureLog:
+    """TestCase for CaptureLog."""
+
+    dir_test = Path(__file__).parent / "test"
+
+    def test_capture(self) -> None:
+        """Test sampling, batch writing and rotation."""
+        for file in self.dir_test.glob("capture*.jsonl"):
+            file.unlink()
+        capture = CaptureLog(
+            path=self.dir_test, name="capture", sample=2, max_bytes=1024, backups=2
+        )
+        for index in range(100):
+            if capture.sampled():
+                capture.add({"index": index, "path": Path("abc"), 200: "OK"})
+        capture.flush()
+
+        files = sorted(self.dir_test.glob("capture*.jsonl"))
+        lines = b"".join(file.read_bytes() for file in files).splitlines()
+        assert len(lines) == 50
+        assert Path(self.dir_test, "capture.1.jsonl") in files
+        assert all(orjson.loads(line)["index"] % 2 == 1 for line in lines)
+        assert orjson.loads(lines[0])["200"] == "OK"
+        assert len(files) <= 3
+
+        capture.close()
+        for file in files:
+            file.unlink()
+
+    def test_write_error(self) -> None:
+        """Test writer thread survives write error, flush not blocked."""
+        blocker = Path(self.dir_test, "capture.blocker")
+        self.dir_test.mkdir(parents=True, exist_ok=True)
+        blocker.write_bytes(b"")
+        # path is a file, mkdir raises FileExistsError
+        capture = CaptureLog(path=blocker, name="capture")
+        capture.add({"index": 0})
+        capture.flush()
+        capture.add({"index": 1})
+        capture.flush()
+        capture.close()
+        assert not capture._thread.is_alive()  # pylint: disable=W0212
+        blocker.unlink()
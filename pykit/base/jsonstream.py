@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Incremental Parser for items of large JSON array."""
+
+from typing import Any, Iterable, Iterator
+
+import orjson
+import regex as re
+
+
+__all__ = ("JsonArrayParser",)
+
+
+# whole string or structural token, closing quote group empty if string
+# is cut by chunk boundary
+PATTERN_TOKEN = re.compile(rb'"(?:[^"\\]++|\\.)*+(")?|[\[\]{},:]', re.DOTALL)
+# rest of string cut by chunk boundary, closing quote group empty if cut again
+PATTERN_STRING_REST = re.compile(rb'(?:[^"\\]++|\\.)*+(")?', re.DOTALL)
+
+
+class JsonArrayParser:
+    """Feed bytes chunks, get items of target JSON array as soon as complete.
+
+    Keys before the array are tracked by token scanning, then items too by
+    nesting depth, resumed where the last chunk ended even inside a string,
+    and items completed by a chunk are decoded by orjson as one array in
+    bulk. Each byte is scanned and decoded once, memory holds pending bytes
+    of one unfinished item instead of whole payload.
+
+    Parameters:
+        - path: tuple of object keys leading to the array, empty for top level
+          array, such as ("data", "children") for `{"data": {"children": []}}`
+    """
+
+    __slots__ = (
+        "path",
+        "buffer",
+        "pos",
+        "stack",
+        "keys",
+        "key",
+        "start",
+        "depth",
+        "quoted",
+        "found",
+        "done",
+    )
+
+    def __init__(self, path: Iterable[str] = ()) -> None:
+        """Init JsonArrayParser."""
+        self.path = list(path)
+        self.buffer = bytearray()
+        self.pos = 0  # scanned position in buffer
+
+        self.stack = bytearray()  # open containers: `{` or `[`
+        self.keys: list[str] = []  # current key of each open object
+        self.key = ""  # last string, become key if followed by colon
+
+        self.start = 0  # start of pending items in buffer
+        self.depth = 0  # nesting depth inside pending item
+        self.quoted = False  # scanned up to pos inside a string
+        self.found = False
+        self.done = False
+
+    def feed(self, chunk: bytes) -> list[Any]:
+        """Feed bytes chunk, return items completed by it."""
+        if self.done:
+            return []
+        self.buffer += chunk
+        if not self.found:
+            self.seek()
+        items = self.cut() if self.found else []
+        self.trim()
+        return items
+
+    def close(self) -> list[Any]:
+        """End of data, raise error if array incomplete.
+
+        Items are decoded once complete, none remains here.
+        """
+        if not self.done:
+            raise orjson.JSONDecodeError(
+                "incomplete json array", self.buffer.decode(errors="replace"), 0
+            )
+        return []
+
+    def seek(self) -> None:
+        """Scan tokens for target array by keys path."""
+        buffer, stack, keys = self.buffer, self.stack, self.keys
+        for token in PATTERN_TOKEN.finditer(buffer, self.pos):
+            index = token.start()
+            char = buffer[index]
+            if char == 34:  # string
+                if token.group(1) is None:
+                    self.pos = index
+                    return
+                if stack and stack[-1] == 123:
+                    self.key = orjson.loads(token.group())
+            elif char == 58:  # colon
+                if keys:
+                    keys[-1] = self.key
+            elif char == 91 and keys == self.path and stack.count(91) == 0:
+                self.found = True
+                self.pos = self.start = index + 1
+                return
+            elif char in b"[{":
+                stack.append(char)
+                keys.append("")
+            elif char in b"]}":
+                stack.pop()
+                keys.pop()
+        self.pos = len(self.buffer)
+
+    def cut(self) -> list[Any]:
+        """Scan pending items from pos, decode completed ones in bulk."""
+        buffer = self.buffer
+        pos = self.pos
+        end = -1  # boundary of last completed item
+        while not self.done:
+            if self.quoted:
+                rest = PATTERN_STRING_REST.match(buffer, pos)
+                pos = rest.end()
+                if rest.group(1) is None:
+                    break
+                self.quoted = False
+            token = PATTERN_TOKEN.search(buffer, pos)
+            if token is None:
+                pos = len(buffer)
+                break
+            pos = token.end()
+            char = buffer[token.start()]
+            if char == 34:  # string
+                if token.group(1) is None:
+                    self.quoted = True
+                    break
+            elif char in b"[{":
+                self.depth += 1
+            elif char in b"]}" and self.depth:
+                self.depth -= 1
+            elif char != 58 and not self.depth:  # `,` or `]` of target array
+                end = token.start()
+                self.done = char == 93
+        self.pos = pos
+        if end < 0:
+            return []
+        items = orjson.loads(b"[" + buffer[self.start:end] + b"]")
+        self.start = end + 1
+        return items
+
+    def trim(self) -> None:
+        """Drop decoded or scanned bytes not needed any more."""
+        if self.done:
+            self.buffer.clear()
+            return
+        keep = min(self.pos, self.start) if self.found else self.pos
+        if keep:
+            del self.buffer[:keep]
+            self.pos -= keep
+            self.start -= keep
+
+    @classmethod
+    def iter_items(
+        cls, chunks: Iterable[bytes], path: Iterable[str] = ()
+    ) -> Iterator[Any]:
+        """Yield items of target array from bytes chunks."""
+        parser = cls(path)
+        for chunk in chunks:
+            yield from parser.feed(chunk)
+            if parser.done:
+                return
+        yield from parser.close()
+
+
+class TestJsonArrayParser:
+    """TestCase for JsonArrayParser."""
+
+    @staticmethod
+    def chunked(data: bytes, size: int) -> Iterator[bytes]:
+        """Split bytes into chunks of size."""
+        for index in range(0, len(data), size):
+            yield data[index:index + size]
+
+    def test_top_level(self) -> None:
+        """Test items of top level array with tricky strings, any chunk size."""
+        items = [
+            {"a": "x,]}[{\"", "b": [1, 2, {"c": None}]},
+            "\\\\\"",
+            12.5,
+            [],
+            {},
+            "中文",
+        ]
+        data = orjson.dumps(items, option=orjson.OPT_INDENT_2)
+        for size in (1, 2, 3, 7, 64, len(data)):
+            assert list(JsonArrayParser.iter_items(self.chunked(data, size))) == items
+        assert not list(JsonArrayParser.iter_items([b" [ ] "]))
+
+    def test_path(self) -> None:
+        """Test items of nested array by keys path, other arrays skipped."""
+        data = orjson.dumps({
+            "kind": "Listing",
+            "tags": ["data", "children"],
+            "data": {
+                "after": "[x]",
+                "dist": [3],
+                "children": [{"id": index} for index in range(3)],
+                "after": "t3_a, t3_b]",
+            },
+        })
+        path = ("data", "children")
+        for size in (1, 5, len(data)):
+            items = list(JsonArrayParser.iter_items(self.chunked(data, size), path))
+            assert items == [{"id": index} for index in range(3)]
+
+    @staticmethod
+    def test_large_item() -> None:
+        """Test item larger than chunk scanned once, string cut at escapes."""
+        text = '\\"' * 50000
+        data = orjson.dumps([{"text": text, "list": [[1]] * 1000}, text])
+        parser = JsonArrayParser()
+        items: list = []
+        for index in range(0, len(data), 1000):
+            items += parser.feed(data[index:index + 1000])
+            # scan resumed where chunk ended, pending item kept only
+            assert parser.done or parser.pos >= len(parser.buffer) - 1
+        assert items + parser.close() == [{"text": text, "list": [[1]] * 1000}, text]
+
+    @staticmethod
+    def test_incomplete() -> None:
+        """Test incomplete or missing array raise error."""
+        for data in (b'[{"a": 1}, {"b"', b'{"a": 1}'):
+            try:
+                list(JsonArrayParser.iter_items([data]))
+            except orjson.JSONDecodeError:
+                continue
+            raise AssertionError(data)
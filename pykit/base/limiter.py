@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Token Bucket Rate Limiter, thread safe and async safe."""
+
+import asyncio
+from time import monotonic, sleep
+from threading import Lock, Thread
+from typing import Optional
+
+
+__all__ = ("TokenBucket", "RateLimiter")
+
+
+class TokenBucket:
+    """Token Bucket refilled by rate tokens per second up to capacity.
+
+    Tokens are reserved under lock and may go negative, the caller then
+    sleeps outside lock, so threads and coroutines never block each other
+    longer than needed.
+    """
+
+    __slots__ = ("rate", "capacity", "tokens", "stamp", "_lock")
+
+    def __init__(self, rate: float, capacity: float = 1.0) -> None:
+        """Init Token Bucket, start full."""
+        assert rate > 0 and capacity > 0
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.stamp = monotonic()
+        self._lock = Lock()
+
+    def _refill(self) -> None:
+        """Refill tokens by time passed."""
+        now = monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+
+    def reserve(self, tokens: float = 1.0) -> float:
+        """Reserve tokens, return seconds to wait before using them."""
+        with self._lock:
+            self._refill()
+            self.tokens -= tokens
+            return max(0.0, -self.tokens / self.rate)
+
+    def try_acquire(self, tokens: float = 1.0) -> bool:
+        """Take tokens only if available now, never wait."""
+        with self._lock:
+            self._refill()
+            if self.tokens >= tokens:
+                self.tokens -= tokens
+                return True
+            return False
+
+    def acquire(self, tokens: float = 1.0) -> float:
+        """Take tokens, sleep only if needed, return seconds slept."""
+        wait = self.reserve(tokens)
+        if wait:
+            sleep(wait)
+        return wait
+
+    async def acquire_async(self, tokens: float = 1.0) -> float:
+        """Take tokens, await only if needed, return seconds waited."""
+        wait = self.reserve(tokens)
+        if wait:
+            await asyncio.sleep(wait)
+        return wait
+
+
+class RateLimiter:
+    """Token Buckets keyed by string, such as host or proxy url.
+
+    Parameters:
+        - rate: float, default tokens per second for each key
+        - capacity: float, default burst size for each key
+        - limits: dict of key: (rate, capacity) to override default
+    """
+
+    def __init__(self,
+                 rate: float,
+                 capacity: float = 1.0,
+                 limits: Optional[dict[str, tuple[float, float]]] = None,
+                 ) -> None:
+        """Init Rate Limiter."""
+        self.rate = rate
+        self.capacity = capacity
+        self.limits = limits if limits else {}
+
+        self._lock = Lock()
+        self._buckets: dict[str, TokenBucket] = {}
+
+    def bucket(self, key: str) -> TokenBucket:
+        """Get token bucket by key, create if not exist."""
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                rate, capacity = self.limits.get(key, (self.rate, self.capacity))
+                bucket = self._buckets[key] = TokenBucket(rate, capacity)
+            return bucket
+
+    def reserve(self, *keys: str) -> float:
+        """Reserve one token from every key, return seconds to wait."""
+        return max(
+            (self.bucket(key).reserve() for key in keys if key),
+            default=0.0,
+        )
+
+    def acquire(self, *keys: str) -> float:
+        """Take one token from every key, sleep only if needed."""
+        wait = self.reserve(*keys)
+        if wait:
+            sleep(wait)
+        return wait
+
+    async def acquire_async(self, *keys: str) -> float:
+        """Take one token from every key, await only if needed."""
+        wait = self.reserve(*keys)
+        if wait:
+            await asyncio.sleep(wait)
+        return wait
+
+
+class TestRateLimiter:
+    """TestCase for TokenBucket and RateLimiter."""
+
+    @staticmethod
+    def test_bucket() -> None:
+        """Test burst and refill."""
+        bucket = TokenBucket(rate=10, capacity=2)
+        assert bucket.try_acquire()
+        assert bucket.try_acquire()
+        assert not bucket.try_acquire()
+        assert 0.05 < bucket.reserve() <= 0.1
+        assert bucket.acquire() > 0.1
+
+    @staticmethod
+    def test_threads() -> None:
+        """Test rate held across threads."""
+        limiter = RateLimiter(rate=50, capacity=1)
+        start = monotonic()
+
+        def run() -> None:
+            for _ in range(5):
+                limiter.acquire("example.com", "http://127.0.0.1:8080")
+
+        threads = [Thread(target=run) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # 20 tokens, first one free, 19 more at 50/s
+        assert monotonic() - start >= 19 / 50 - 0.01
+        assert limiter.reserve("other.com") == 0
+
+    @staticmethod
+    def test_async() -> None:
+        """Test rate held across coroutines."""
+        limiter = RateLimiter(rate=10, capacity=1, limits={"fast.com": (1000, 1)})
+
+        async def run() -> float:
+            start = monotonic()
+            await asyncio.gather(*[limiter.acquire_async("slow.com") for _ in range(3)])
+            await asyncio.gather(*[limiter.acquire_async("fast.com") for _ in range(3)])
+            return monotonic() - start
+
+        assert 0.19 <= asyncio.run(run()) < 0.3
@@ -0,0 +1,595 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Asyncio IMAP Client, scan many mailboxes concurrently through proxy."""
+
+import ssl
+import socket
+import select
+import struct
+import asyncio
+import imaplib
+import socketserver
+from threading import Thread
+from ipaddress import ip_address
+from typing import Any, Dict, Iterable, List, Optional, Union
+
+import arrow
+import regex as re
+from regex import Pattern
+
+from ..base.proxy import Proxy
+from .imap import PATTERN_ESEARCH, PATTERN_FETCH_UID, ImapClient
+
+
+__all__ = ("ProxyTunnel", "AsyncImapClient", "AsyncImapScanner")
+
+
+# response line ends with literal size, such as `* 1 FETCH (BODY[] {123}`
+PATTERN_LITERAL = re.compile(rb"\{(\d+)\}\r\n$")
+
+
+class ProxyTunnel:
+    """Open asyncio stream to host through HTTP/SOCKS4/SOCKS5 proxy."""
+
+    # max bytes of one line, `* SEARCH` of big mailbox exceeds 64 KiB default
+    limit = 16 * 1024 * 1024
+
+    @classmethod
+    async def open(
+        cls,
+        host: str,
+        port: int,
+        proxy: Optional[Proxy] = None,
+        timeout: float = 30.0,
+    ) -> tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+        """Open stream to host, tunnel established if proxy."""
+        if not proxy:
+            return await asyncio.wait_for(
+                asyncio.open_connection(host, port, limit=cls.limit), timeout
+            )
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(proxy.addr, proxy.port, limit=cls.limit), timeout
+        )
+        handshake = {3: cls.http, 2: cls.socks5, 1: cls.socks4}[proxy.type]
+        try:
+            await asyncio.wait_for(handshake(reader, writer, host, port, proxy), timeout)
+        except BaseException:
+            writer.close()
+            raise
+        return reader, writer
+
+    @staticmethod
+    async def http(
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+        host: str,
+        port: int,
+        proxy: Proxy,
+    ) -> None:
+        """HTTP CONNECT tunnel."""
+        target = f"[{host}]:{port}" if ":" in host else f"{host}:{port}"
+        lines = [f"CONNECT {target} HTTP/1.1", f"Host: {target}"]
+        if proxy.usr and proxy.pwd:
+            lines.append(": ".join(proxy.auth))
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode())
+        await writer.drain()
+        status = await reader.readline()
+        while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+            continue
+        parts = status.split()
+        if len(parts) < 2 or parts[1] != b"200":
+            raise ConnectionError(f"http proxy refused: {status!r}")
+
+    @staticmethod
+    def address(host: str, rdns: bool) -> tuple[int, bytes]:
+        """Get SOCKS5 address type and bytes of host."""
+        try:
+            addr = ip_address(host)
+        except ValueError:
+            if rdns:
+                name = host.encode("idna")
+                return 3, bytes([len(name)]) + name
+            host = socket.gethostbyname(host)
+            addr = ip_address(host)
+        return (1 if addr.version == 4 else 4), addr.packed
+
+    @classmethod
+    async def socks5(
+        cls,
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+        host: str,
+        port: int,
+        proxy: Proxy,
+    ) -> None:
+        """SOCKS5 tunnel, with username/password auth if any."""
+        methods = b"\x00\x02" if proxy.usr else b"\x00"
+        writer.write(b"\x05" + bytes([len(methods)]) + methods)
+        await writer.drain()
+        _, method = await reader.readexactly(2)
+        if method == 2:
+            usr, pwd = proxy.usr.encode(), proxy.pwd.encode()
+            writer.write(b"\x01" + bytes([len(usr)]) + usr + bytes([len(pwd)]) + pwd)
+            await writer.drain()
+            if (await reader.readexactly(2))[1] != 0:
+                raise ConnectionError("socks5 proxy auth failed")
+        elif method != 0:
+            raise ConnectionError(f"socks5 proxy method refused: {method}")
+
+        atyp, addr = cls.address(host, proxy.rdns)
+        writer.write(b"\x05\x01\x00" + bytes([atyp]) + addr + struct.pack(">H", port))
+        await writer.drain()
+        _, reply, _, atyp = await reader.readexactly(4)
+        if reply != 0:
+            raise ConnectionError(f"socks5 proxy connect failed: {reply}")
+        if atyp == 3:
+            size = (await reader.readexactly(1))[0]
+        else:
+            size = 4 if atyp == 1 else 16
+        await reader.readexactly(size + 2)
+
+    @staticmethod
+    async def socks4(
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+        host: str,
+        port: int,
+        proxy: Proxy,
+    ) -> None:
+        """SOCKS4 tunnel, SOCKS4a if hostname resolved by proxy."""
+        suffix = b""
+        try:
+            addr = ip_address(host).packed
+        except ValueError:
+            if proxy.rdns:
+                addr, suffix = b"\x00\x00\x00\x01", host.encode("idna") + b"\x00"
+            else:
+                addr = socket.inet_aton(socket.gethostbyname(host))
+        usr = proxy.usr.encode() + b"\x00"
+        writer.write(b"\x04\x01" + struct.pack(">H", port) + addr + usr + suffix)
+        await writer.drain()
+        reply = await reader.readexactly(8)
+        if reply[1] != 0x5A:
+            raise ConnectionError(f"socks4 proxy connect failed: {reply[1]}")
+
+
+class AsyncImapClient:
+    """Asyncio IMAP Client with search/lookup semantics of ImapClient.
+
+    Query building and message parsing are shared with ImapClient.
+    """
+
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        usr: str,
+        pwd: str,
+        ssl_enable: bool = True,
+        proxy: Optional[Proxy] = None,
+        timeout: float = 30.0,
+        encoding: str = "unicode_escape",
+    ) -> None:
+        """Init Async IMAP Client."""
+        self.host = host
+        self.port = port
+        self.usr = usr
+        self.pwd = pwd
+        self.ssl = ssl_enable
+        self.proxy = proxy
+        self.timeout = timeout
+        self.parser = ImapClient(
+            host, port, usr, pwd, ssl_enable, demo=False, proxy=proxy, encoding=encoding
+        )
+
+        self.folders = ["Inbox"]
+        self.capabilities: set[str] = set()
+        self.reader: Optional[asyncio.StreamReader] = None
+        self.writer: Optional[asyncio.StreamWriter] = None
+        self.tag = 0
+
+    async def connect(self) -> None:
+        """Open connection, TLS started after proxy tunnel."""
+        self.reader, self.writer = await ProxyTunnel.open(
+            self.host, self.port, self.proxy, self.timeout
+        )
+        if self.ssl:
+            context = ssl._create_unverified_context()  # pylint: disable=W0212
+            await asyncio.wait_for(
+                self.writer.start_tls(context, server_hostname=self.host), self.timeout
+            )
+        greeting = await self.readline()
+        if not greeting.startswith(b"* OK"):
+            raise imaplib.IMAP4.error(f"bad greeting: {greeting!r}")
+
+    async def readline(self) -> bytes:
+        """Read response line, raise abort if connection closed."""
+        assert self.reader
+        line = await asyncio.wait_for(self.reader.readline(), self.timeout)
+        if not line:
+            raise imaplib.IMAP4.abort("socket error: EOF")
+        return line
+
+    async def command(self, *args: str) -> tuple[str, List[Union[bytes, tuple]]]:
+        """Send command, get status and untagged responses.
+
+        Response with literal kept as tuple of (head, literal) like imaplib.
+        """
+        assert self.reader and self.writer
+        self.tag += 1
+        tag = f"A{self.tag:04d}".encode()
+        self.writer.write(tag + b" " + " ".join(args).encode() + b"\r\n")
+        await self.writer.drain()
+
+        untagged: List[Union[bytes, tuple]] = []
+        while True:
+            line = await self.readline()
+            if line.startswith(tag + b" "):
+                return line.split()[1].decode().upper(), untagged
+            found = PATTERN_LITERAL.search(line)
+            while found:
+                data = await asyncio.wait_for(
+                    self.reader.readexactly(int(found.group(1))), self.timeout
+                )
+                untagged.append((line, data))
+                line = await self.readline()
+                found = PATTERN_LITERAL.search(line)
+            untagged.append(line)
+
+    async def login(self) -> bool:
+        """Connect and login, capabilities updated."""
+        await self.connect()
+        status, _ = await self.command(
+            "LOGIN", self.parser.quote(self.usr), self.parser.quote(self.pwd)
+        )
+        if status != "OK":
+            return False
+        _, lines = await self.command("CAPABILITY")
+        for line in lines:
+            if isinstance(line, bytes) and line.upper().startswith(b"* CAPABILITY"):
+                self.capabilities = set(line.decode().upper().split()[2:])
+        return True
+
+    async def logout(self) -> None:
+        """Logout and close connection, errors ignored."""
+        if not self.writer:
+            return
+        try:
+            await self.command("LOGOUT")
+        except (imaplib.IMAP4.error, OSError, asyncio.TimeoutError, ValueError, EOFError):
+            pass
+        finally:
+            self.writer.close()
+            self.reader = self.writer = None
+
+    async def __aenter__(self) -> "AsyncImapClient":
+        try:
+            logged = await self.login()
+        except BaseException:
+            await self.logout()
+            raise
+        if not logged:
+            await self.logout()
+            raise imaplib.IMAP4.error(f"login failed: {self.usr}")
+        return self
+
+    async def __aexit__(self, *args: Any) -> None:
+        await self.logout()
+
+    async def get_uids(self, folder: str, query: str) -> List[str]:
+        """Select folder and UID SEARCH, ESEARCH used if supported."""
+        status, _ = await self.command("SELECT", self.parser.quote(folder))
+        if status != "OK":
+            return []
+        if "ESEARCH" in self.capabilities:
+            status, lines = await self.command("UID SEARCH RETURN (ALL)", query)
+            for line in lines:
+                if isinstance(line, bytes) and line.upper().startswith(b"* ESEARCH"):
+                    for key, value in PATTERN_ESEARCH.findall(line):
+                        if key.upper() == b"ALL":
+                            return self.parser.expand_set(value.decode())
+            return []
+        status, lines = await self.command("UID SEARCH", query)
+        for line in lines:
+            if isinstance(line, bytes) and line.upper().startswith(b"* SEARCH"):
+                return [x.decode() for x in line.split()[2:]]
+        return []
+
+    async def fetch_many(
+        self, uids: List[str], items: str, batch: int = 200
+    ) -> Dict[str, bytes]:
+        """UID FETCH items of many messages, one command for each batch."""
+        result: Dict[str, bytes] = {}
+        for index in range(0, len(uids), batch):
+            msg_set = self.parser.msg_set(uids[index:index + batch])
+            status, lines = await self.command("UID FETCH", msg_set, items)
+            if status != "OK":
+                continue
+            for line in lines:
+                if isinstance(line, tuple):
+                    found = PATTERN_FETCH_UID.search(line[0])
+                    if found:
+                        result[found.group(1).decode()] = line[1]
+        return result
+
+    async def lookup(
+        self,
+        query: str,
+        pattern: Pattern,
+        timestamp: int = 0,
+        subject: str = "",
+        batch: int = 200,
+        sender: str = "",
+        to: str = "",
+    ) -> list:
+        """lookup through mailbox and filter email content by regex
+
+        Header fields fetched in batch and filtered by subject, timestamp,
+        sender and to, then bodies of candidates only, same as
+        `ImapClient.lookup`.
+        """
+        result: list = []
+        fields = " ".join(self.parser.header_fields)
+        for folder in self.folders:
+            uids = list(reversed(await self.get_uids(folder, query)))
+            headers = await self.fetch_many(
+                uids, f"(BODY.PEEK[HEADER.FIELDS ({fields})])", batch
+            )
+            candidates = [
+                uid for uid in uids
+                if uid in headers
+                and self.parser.match_header(headers[uid], subject, timestamp, sender, to)
+            ]
+            bodies = await self.fetch_many(candidates, "(BODY.PEEK[])", batch)
+            for uid in candidates:
+                if uid not in bodies:
+                    continue
+                msg_data = self.parser.parse_msg(uid, bodies[uid], timestamp)
+                if msg_data and pattern:
+                    result.extend(pattern.findall(msg_data["body"]))
+        return list(set(result))
+
+    async def search(
+        self,
+        from_email: str,
+        to_email: str,
+        subject: str,
+        pattern: Pattern,
+        time_stamp: int = 0,
+        retry: int = 6,
+        poll: float = 60.0,
+    ) -> List[str]:
+        """search email by various filters, login if not yet
+
+        Connection opened here is closed on return or error.
+        """
+        query = self.parser.build_query(from_email, to_email, subject, time_stamp)
+        opened = not self.writer
+        try:
+            for index in range(retry):
+                if not self.writer and not await self.login():
+                    return []
+                results = await self.lookup(
+                    query, pattern, time_stamp, subject, sender=from_email, to=to_email
+                )
+                if results or index + 1 == retry:
+                    return results
+                await asyncio.sleep(poll)
+            return []
+        finally:
+            if opened:
+                await self.logout()
+
+
+class AsyncImapScanner:
+    """Scan many mailboxes concurrently.
+
+    Parameters:
+        - limit: int, max connections at the same time
+        - per_provider: int, max connections to one IMAP host
+        - limits: dict of host: int to override per_provider
+    """
+
+    def __init__(
+        self,
+        limit: int = 100,
+        per_provider: int = 10,
+        limits: Optional[Dict[str, int]] = None,
+    ) -> None:
+        """Init Async IMAP Scanner."""
+        self.limit = limit
+        self.per_provider = per_provider
+        self.limits = limits if limits else {}
+        self.errors: Dict[str, str] = {}  # error of usr in last scan
+
+        self._global: Optional[asyncio.Semaphore] = None
+        self._providers: Dict[str, asyncio.Semaphore] = {}
+
+    def provider(self, host: str) -> asyncio.Semaphore:
+        """Get semaphore of provider host."""
+        semaphore = self._providers.get(host)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(self.limits.get(host, self.per_provider))
+            self._providers[host] = semaphore
+        return semaphore
+
+    async def search(
+        self,
+        client: AsyncImapClient,
+        from_email: str,
+        subject: str,
+        pattern: Pattern,
+        time_stamp: int = 0,
+        retry: int = 1,
+        poll: float = 60.0,
+    ) -> tuple[str, List[str]]:
+        """Search mailbox of client within limits, to_email as its user."""
+        assert self._global
+        # host slot first, global slots not held while waiting on busy host
+        async with self.provider(client.host), self._global:
+            try:
+                async with client:
+                    results = await client.search(
+                        from_email, client.usr, subject, pattern, time_stamp, retry, poll
+                    )
+                return client.usr, results
+            except (
+                imaplib.IMAP4.error, OSError, asyncio.TimeoutError, ValueError, EOFError
+            ) as err:
+                # ValueError of line over limit, EOFError of incomplete read
+                self.errors[client.usr] = repr(err)
+                return client.usr, []
+
+    async def search_many(
+        self,
+        clients: Iterable[AsyncImapClient],
+        from_email: str,
+        subject: str,
+        pattern: Pattern,
+        time_stamp: int = 0,
+        retry: int = 1,
+        poll: float = 60.0,
+    ) -> Dict[str, List[str]]:
+        """Search mailboxes concurrently, get results by user."""
+        self._global = asyncio.Semaphore(self.limit)
+        self._providers.clear()
+        self.errors.clear()
+        results = await asyncio.gather(*[
+            self.search(client, from_email, subject, pattern, time_stamp, retry, poll)
+            for client in clients
+        ])
+        return dict(results)
+
+
+class TestAsyncImapClient:
+    """TestCase for AsyncImapClient with local IMAP and proxy stand-ins."""
+
+    class Server(socketserver.ThreadingTCPServer):
+        """Threading TCP server with daemon threads."""
+
+        daemon_threads = True
+
+    class Tunnel(socketserver.BaseRequestHandler):
+        """Minimal proxy, HTTP CONNECT or SOCKS5 without auth."""
+
+        def handle(self) -> None:
+            """Tunnel client to target."""
+            sock = self.request
+            head = sock.recv(1024)
+            if head[:1] == b"\x05":
+                sock.sendall(b"\x05\x00")
+                head = sock.recv(1024)
+                if head[3] == 3:
+                    host = head[5:5 + head[4]].decode()
+                else:
+                    host = socket.inet_ntoa(head[4:8])
+                port = struct.unpack(">H", head[-2:])[0]
+                reply = b"\x05\x00\x00\x01" + bytes(6)
+            else:
+                while b"\r\n\r\n" not in head:
+                    head += sock.recv(1024)
+                host, _, port = head.split()[1].decode().rpartition(":")
+                reply = b"HTTP/1.1 200 Connection established\r\n\r\n"
+            with socket.create_connection((host, int(port))) as target:
+                sock.sendall(reply)
+                socks_ = [sock, target]
+                while True:
+                    readable, _, _ = select.select(socks_, [], [], 5)
+                    if not readable:
+                        return
+                    for item in readable:
+                        data = item.recv(4096)
+                        if not data:
+                            return
+                        (target if item is sock else sock).sendall(data)
+
+    def test_scan(self) -> None:
+        """Test search through proxies within limits of many mailboxes."""
+        from .imap import TestImapClient  # pylint: disable=C0415
+        servers = [TestImapClient.Server(("ESEARCH",)), TestImapClient.Server()]
+        for host, server in zip(("127.0.0.1", "localhost"), servers):
+            server.add("Newsletter", "nothing here")
+            for index in range(12):
+                link = f"https://example.com/verify/{index}"
+                server.add("Verify your email", link, to=f"user{index}@{host}")
+            server.add("Verify your email", "https://example.com/verify/old", days=9)
+            server.serve()
+        tunnel = self.Server(("127.0.0.1", 0), self.Tunnel)
+        Thread(target=tunnel.serve_forever, daemon=True).start()
+        proxies = [
+            None,
+            Proxy.load(f"http://127.0.0.1:{tunnel.server_address[1]}"),
+            Proxy.load(f"socks5://127.0.0.1:{tunnel.server_address[1]}"),
+        ]
+
+        clients = [
+            AsyncImapClient(
+                host,
+                server.server_address[1],
+                f"user{index}@{host}",
+                "password",
+                ssl_enable=False,
+                proxy=proxies[index % 3],
+            )
+            for index in range(12)
+            for host, server in (("127.0.0.1", servers[0]), ("localhost", servers[1]))
+        ]
+        clients.append(AsyncImapClient("127.0.0.1", 1, "dead@example.com", "", False))
+        pattern = re.compile(r"https://example\.com/verify/\w+")
+        timestamp = int(arrow.now().shift(days=-1).timestamp())
+
+        scanner = AsyncImapScanner(limit=5, per_provider=3, limits={"localhost": 2})
+        results = asyncio.run(scanner.search_many(
+            clients, "noreply@example.com", "Verify", pattern, timestamp
+        ))
+        assert len(results) == 25
+        assert results["user0@127.0.0.1"] == ["https://example.com/verify/0"]
+        assert results["user5@localhost"] == ["https://example.com/verify/5"]
+        assert list(scanner.errors) == ["dead@example.com"]
+        assert 1 < servers[0].peak <= 3 and 1 < servers[1].peak <= 2
+        assert any(x.startswith("UID SEARCH RETURN (ALL)") for x in servers[0].commands)
+        assert not any("RETURN" in x for x in servers[1].commands)
+
+        # connection opened by search is closed again
+        port = servers[0].server_address[1]
+        client = AsyncImapClient("127.0.0.1", port, "user1@127.0.0.1", "", False)
+        links = asyncio.run(
+            client.search("noreply@example.com", client.usr, "Verify", pattern, timestamp)
+        )
+        assert links == ["https://example.com/verify/1"] and client.writer is None
+        for server in (*servers, tunnel):
+            server.shutdown()
+
+    def test_large_search(self) -> None:
+        """Test `* SEARCH` line over 64 KiB, error of line over limit kept per mailbox."""
+        from .imap import TestImapClient  # pylint: disable=C0415
+        server = TestImapClient.Server()
+        server.add("Verify your email", "https://example.com/verify/big", to="big@example.com")
+        server.add("Verify your email", "https://example.com/verify/other", to="other@example.com")
+        (_, big), (_, other) = server.messages
+        # long uids, 14 bytes each in `* SEARCH` line
+        server.messages = [(10 ** 12 + index, big) for index in range(5000)]
+        server.messages.append((10 ** 12 + 5000, other))
+        port = server.serve()
+        clients = [
+            AsyncImapClient("127.0.0.1", port, usr, "", False)
+            for usr in ("big@example.com", "other@example.com")
+        ]
+        pattern = re.compile(r"https://example\.com/verify/\w+")
+
+        scanner = AsyncImapScanner()
+        results = asyncio.run(scanner.search_many(clients[:1], "", "Verify", pattern))
+        assert results == {"big@example.com": ["https://example.com/verify/big"]}
+        assert not scanner.errors
+
+        limit, ProxyTunnel.limit = ProxyTunnel.limit, 1024
+        try:
+            results = asyncio.run(scanner.search_many(clients, "", "Verify", pattern))
+        finally:
+            ProxyTunnel.limit = limit
+        assert results == {
+            "big@example.com": [], "other@example.com": ["https://example.com/verify/other"]
+        }
+        assert "ValueError" in scanner.errors["big@example.com"]
+        server.shutdown()
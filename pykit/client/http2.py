@@ -0,0 +1,363 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""HTTP/2 Backend for Http, requests.Session like wrapper over httpx."""
+
+import http.server
+import socket
+import socketserver
+import struct
+from datetime import timedelta
+from http.cookiejar import CookieJar, DefaultCookiePolicy
+from threading import Lock, Thread
+from time import perf_counter
+from typing import Any, Iterator, Optional
+
+import httpx
+import orjson
+import requests
+from requests import Response
+from requests.cookies import cookiejar_from_dict
+from requests.exceptions import ChunkedEncodingError, ContentDecodingError, InvalidURL
+from requests.structures import CaseInsensitiveDict
+from requests.utils import default_headers
+
+from .stats import record_connect
+
+
+__all__ = ("Http2Session",)
+
+
+class BlockCookiePolicy(DefaultCookiePolicy):
+    """Cookie Policy accept nothing, keep shared httpx client stateless."""
+
+    def set_ok(self, cookie: Any, request: Any) -> bool:
+        return False
+
+
+def request_error(err: httpx.HTTPError) -> requests.RequestException:
+    """Map httpx error of sending request into requests exception."""
+    if isinstance(err, httpx.TimeoutException):
+        return requests.Timeout(err, request=None)
+    if isinstance(err, httpx.ProxyError):
+        return requests.exceptions.ProxyError(err, request=None)
+    if isinstance(err, httpx.UnsupportedProtocol):
+        return InvalidURL(err, request=None)
+    if isinstance(err, httpx.TransportError):
+        # network and protocol errors, retried and rotated as by requests
+        return requests.ConnectionError(err, request=None)
+    return requests.RequestException(err, request=None)
+
+
+def stream_error(err: httpx.HTTPError) -> requests.RequestException:
+    """Map httpx error of reading body into requests exception."""
+    if isinstance(err, httpx.DecodingError):
+        return ContentDecodingError(err)
+    if isinstance(err, (httpx.TimeoutException, httpx.NetworkError)):
+        return requests.ConnectionError(err)
+    return ChunkedEncodingError(err)
+
+
+class StreamRaw:
+    """File-like `Response.raw` over httpx stream, body decoded."""
+
+    def __init__(self, response: httpx.Response) -> None:
+        """Init with httpx response opened by stream."""
+        self.response = response
+        self.chunks: Iterator[bytes] = response.iter_bytes()
+        self.buffer = bytearray()
+
+    def read(self, amt: Optional[int] = None, **kwargs: Any) -> bytes:
+        """Read up to amt bytes, all remaining if amt is None."""
+        while amt is None or len(self.buffer) < amt:
+            try:
+                chunk = next(self.chunks, b"")
+            except httpx.HTTPError as err:
+                raise stream_error(err) from err
+            if not chunk:
+                break
+            self.buffer += chunk
+        if amt is None:
+            amt = len(self.buffer)
+        data = bytes(self.buffer[:amt])
+        del self.buffer[:amt]
+        return data
+
+    def close(self) -> None:
+        """Close stream, release connection."""
+        self.response.close()
+
+
+class Timer:
+    """Trace callback of httpcore, record connect and response headers time."""
+
+    __slots__ = ("start", "marks")
+
+    def __init__(self) -> None:
+        self.start = perf_counter()
+        self.marks: dict[str, float] = {}
+
+    def __call__(self, name: str, info: dict) -> None:
+        # first tcp connect is to proxy if any, keep the earliest one
+        self.marks.setdefault(name, perf_counter())
+        if name.endswith("start_tls.complete"):
+            self.marks[name] = perf_counter()
+
+    def record(self) -> None:
+        """Record (tcp, connect) of this request into current thread."""
+        marks = self.marks
+        begin = marks.get("connection.connect_tcp.started")
+        if begin is None:
+            record_connect(-1.0, -1.0)
+            return
+        tcp = marks.get("connection.connect_tcp.complete", begin)
+        tls = marks.get("connection.start_tls.complete", tcp)
+        record_connect(tcp - begin, max(tcp, tls) - begin)
+
+    def elapsed(self) -> float:
+        """Seconds from start to response headers received."""
+        for prefix in ("http2", "http11"):
+            mark = self.marks.get(f"{prefix}.receive_response_headers.complete")
+            if mark is not None:
+                return mark - self.start
+        return perf_counter() - self.start
+
+
+class Http2Session:
+    """requests.Session like client sending over HTTP/2 when server supports.
+
+    One httpx client per proxy url is shared by all sessions, so requests
+    from many Http and threads to the same host are multiplexed as streams
+    over single connection. Headers and cookies are kept per session.
+    """
+
+    _clients: dict[str, httpx.Client] = {}
+    _lock = Lock()
+
+    def __init__(self, proxy_url: str = "") -> None:
+        """Init HTTP/2 Session."""
+        self.proxy_url = proxy_url
+        self.headers: CaseInsensitiveDict = default_headers()
+        self.cookies = httpx.Cookies()
+        self.client = self.shared(proxy_url)
+
+    @classmethod
+    def shared(cls, proxy_url: str = "") -> httpx.Client:
+        """Get shared httpx client of proxy url, create if not exist."""
+        with cls._lock:
+            client = cls._clients.get(proxy_url)
+            if client is None:
+                client = httpx.Client(
+                    http2=True,
+                    proxy=proxy_url or None,
+                    cookies=CookieJar(policy=BlockCookiePolicy()),
+                )
+                cls._clients[proxy_url] = client
+            return client
+
+    @classmethod
+    def close_all(cls) -> None:
+        """Close all shared httpx clients."""
+        with cls._lock:
+            for client in cls._clients.values():
+                client.close()
+            cls._clients.clear()
+
+    def merge_headers(self, headers: Optional[dict]) -> dict:
+        """Merge session headers with request headers, drop key of None value."""
+        merged = CaseInsensitiveDict(self.headers)
+        merged.update(headers or {})
+        return {key: value for key, value in merged.items() if value is not None}
+
+    def request(
+        self,
+        method: str,
+        url: str,
+        params: Any = None,
+        data: Any = None,
+        headers: Optional[dict] = None,
+        cookies: Optional[dict] = None,
+        files: Any = None,
+        auth: Any = None,
+        timeout: Any = None,
+        allow_redirects: bool = True,
+        stream: bool = False,
+        json: Any = None,
+        **kwargs: Any,
+    ) -> Response:
+        """Send request like `requests.Session.request`.
+
+        `proxies`, `verify` and `cert` are ignored, proxy is bound at init.
+        """
+        jar = httpx.Cookies(self.cookies)
+        if cookies:
+            jar.update(cookies)
+        content = None
+        if isinstance(data, (str, bytes)):
+            content, data = data, None
+
+        timer = Timer()
+        request = self.client.build_request(
+            method,
+            url,
+            params=params,
+            content=content,
+            data=data,
+            files=files,
+            json=json,
+            headers=self.merge_headers(headers),
+            cookies=jar,
+            timeout=timeout,
+            extensions={"trace": timer},
+        )
+        try:
+            res = self.client.send(
+                request,
+                stream=True,
+                auth=auth,
+                follow_redirects=allow_redirects,
+            )
+            elapsed = timer.elapsed()
+            if not stream:
+                try:
+                    res.read()
+                finally:
+                    res.close()
+        except httpx.HTTPError as err:
+            raise request_error(err) from err
+        finally:
+            timer.record()
+
+        for item in (*res.history, res):
+            self.cookies.extract_cookies(item)
+        return self.to_response(res, stream, elapsed)
+
+    @staticmethod
+    def to_response(res: httpx.Response, stream: bool, elapsed: float) -> Response:
+        """Convert httpx response into requests Response."""
+        response = Response()
+        response.status_code = res.status_code
+        response.reason = res.reason_phrase
+        response.url = str(res.url)
+        response.headers = CaseInsensitiveDict(res.headers)
+        response.encoding = res.charset_encoding
+        response.cookies = cookiejar_from_dict(dict(res.cookies))
+        response.elapsed = timedelta(seconds=elapsed)
+        if stream:
+            response.raw = StreamRaw(res)
+        else:
+            response._content = res.content  # pylint: disable=W0212
+            response._content_consumed = True  # pylint: disable=W0212
+        return response
+
+    def close(self) -> None:
+        """Shared client kept open for other sessions, see `close_all`."""
+
+
+class TestHttp2Session:
+    """TestCase for Http2Session, HTTP/1.1 fallback over plain local server."""
+
+    class Server(socketserver.ThreadingTCPServer):
+        """Threading TCP server with daemon threads."""
+
+        daemon_threads = True
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        """Echo request method, path and headers."""
+
+        protocol_version = "HTTP/1.1"
+
+        def reply(self) -> None:
+            """Echo request as json, set cookie."""
+            length = int(self.headers.get("Content-Length") or 0)
+            body = self.rfile.read(length)
+            data = {
+                "method": self.command,
+                "path": self.path,
+                "agent": self.headers.get("User-Agent"),
+                "cookie": self.headers.get("Cookie", ""),
+                "body": body.decode(),
+            }
+            content = orjson.dumps(data)
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(content)))
+            self.send_header("Set-Cookie", "sid=1; Path=/")
+            self.end_headers()
+            self.wfile.write(content)
+
+        def do_GET(self) -> None:  # pylint: disable=C0103
+            """Reset connection on `/reset`, cut body on `/cut`, echo otherwise."""
+            if self.path == "/reset":
+                # RST instead of FIN, read error of client
+                linger = struct.pack("ii", 1, 0)
+                self.connection.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, linger)
+                self.close_connection = True
+                for item in (self.rfile, self.connection):
+                    item.close()
+                return
+            if self.path == "/cut":
+                self.send_response(200)
+                self.send_header("Content-Length", "100")
+                self.end_headers()
+                self.wfile.write(b"[1, 2")
+                self.close_connection = True
+                return
+            self.reply()
+
+        do_POST = reply
+
+        def log_message(self, *args: object) -> None:
+            """Silent."""
+
+    def test_request(self) -> None:
+        """Test headers, cookies, body and stream."""
+        server = self.Server(("127.0.0.1", 0), self.Handler)
+        Thread(target=server.serve_forever, daemon=True).start()
+        url = f"http://127.0.0.1:{server.server_address[1]}/echo"
+
+        session = Http2Session()
+        session.headers["User-Agent"] = "pykit"
+        response = session.request("GET", url, params={"q": "1"}, timeout=5)
+        assert response.ok
+        assert response.json()["path"] == "/echo?q=1"
+        assert response.json()["agent"] == "pykit"
+        assert response.cookies["sid"] == "1"
+        assert dict(session.cookies) == {"sid": "1"}
+
+        response = session.request("POST", url, data="x=1", timeout=5)
+        assert response.json()["body"] == "x=1"
+        assert response.json()["cookie"] == "sid=1"
+
+        # cookies of one session not leaked into other
+        other = Http2Session()
+        assert other.client is session.client
+        assert other.request("GET", url, timeout=5).json()["cookie"] == ""
+
+        response = session.request("GET", url, stream=True, timeout=5)
+        assert b'"method"' in response.raw.read(16)
+        response.close()
+        server.shutdown()
+
+    def test_errors(self) -> None:
+        """Test httpx errors mapped as requests, also mid-stream."""
+        server = self.Server(("127.0.0.1", 0), self.Handler)
+        Thread(target=server.serve_forever, daemon=True).start()
+        url = f"http://127.0.0.1:{server.server_address[1]}"
+        session = Http2Session()
+        for path in ("/reset", "/cut"):
+            try:
+                session.request("GET", url + path, timeout=5)
+            except requests.ConnectionError:
+                continue
+            raise AssertionError(path)
+
+        response = session.request("GET", url + "/cut", stream=True, timeout=5)
+        try:
+            list(response.iter_content(16))
+        except ChunkedEncodingError:
+            pass
+        else:
+            raise AssertionError("cut body")
+        response.close()
+        server.shutdown()
@@ -0,0 +1,313 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""HTTP Response Cache honoring Cache-Control/ETag/Last-Modified.
+
+Features:
+- Memory Cache, persisted into file by `save` and on exit
+- Fresh response served without network
+- Stale response revalidated by conditional request
+- Hit/Miss/Revalidated stats
+- Entries apart by credentials of request and by `Vary` headers
+
+"""
+
+import atexit
+from time import time
+from hashlib import sha256
+from base64 import b64decode, b64encode
+from pathlib import Path
+from threading import Lock
+from email.utils import parsedate_to_datetime
+from typing import Any, Iterable
+
+from requests import Response
+from requests.models import PreparedRequest
+from requests.structures import CaseInsensitiveDict
+
+from ..utils.cache import MemoryCache
+
+
+__all__ = ("HttpCache",)
+
+
+class HttpCache:
+    """HTTP Cache for GET responses."""
+
+    def __init__(self,
+                 file: Path,
+                 seconds: int = 86400 * 7,
+                 default_ttl: int = 0,
+                 ) -> None:
+        """Init HTTP Cache.
+
+        Parameters:
+            - file: Path, local file to persist cached responses, saved on exit
+            - seconds: int, max seconds to keep any response in cache
+            - default_ttl: int, fresh seconds for response without cache headers
+        """
+        self.memory = MemoryCache(file=file, seconds=seconds)
+        self.default_ttl = default_ttl
+
+        self._lock = Lock()
+        self.stats = {"hit": 0, "miss": 0, "revalidated": 0, "stored": 0}
+        if file:
+            atexit.register(self.save)
+
+    def count(self, name: str) -> None:
+        """Add 1 to stats of name."""
+        with self._lock:
+            self.stats[name] += 1
+
+    @staticmethod
+    def identity(headers: Any, cookies: Iterable[str] = (), auth: Any = None) -> str:
+        """Get digest of request credentials, empty if anonymous.
+
+        Credentials are hashed, not persisted as is into cache file.
+        """
+        parts = [headers.get(x) or "" for x in ("Authorization", "Cookie")]
+        parts.extend(sorted(cookies))
+        if auth:
+            parts.append(repr(auth))
+        if not any(parts):
+            return ""
+        return sha256("\n".join(parts).encode()).hexdigest()[:32]
+
+    @staticmethod
+    def key(url: str, params: Any = None, identity: str = "") -> str:
+        """Get cache key as full url with query params, and identity if any."""
+        if params:
+            prepared = PreparedRequest()
+            prepared.prepare_url(url, params)
+            url = str(prepared.url)
+        return f"{url} {identity}" if identity else url
+
+    @staticmethod
+    def vary(headers: Any, request_headers: Any) -> dict[str, str]:
+        """Get request header values named by `Vary` of response headers."""
+        request_headers = CaseInsensitiveDict(request_headers or {})
+        names = [x.strip().lower() for x in headers.get("Vary", "").split(",")]
+        return {name: request_headers.get(name) or "" for name in names if name}
+
+    @staticmethod
+    def directives(headers: Any) -> dict[str, str]:
+        """Parse `Cache-Control` header into dict of directive."""
+        result: dict[str, str] = {}
+        for item in headers.get("Cache-Control", "").split(","):
+            name, _, value = item.strip().partition("=")
+            if name:
+                result[name.lower()] = value.strip('"')
+        return result
+
+    def ttl(self, headers: Any) -> int:
+        """Get fresh seconds of response from `Cache-Control` or `Expires`."""
+        control = self.directives(headers)
+        if "no-cache" in control:
+            return 0
+        if control.get("max-age", "").isdigit():
+            return int(control["max-age"])
+        if "Expires" in headers:
+            try:
+                expires = parsedate_to_datetime(headers["Expires"]).timestamp()
+                date = time()
+                if "Date" in headers:
+                    date = parsedate_to_datetime(headers["Date"]).timestamp()
+                return max(int(expires - date), 0)
+            except (TypeError, ValueError):
+                return 0
+        return self.default_ttl
+
+    def storable(self, response: Response) -> bool:
+        """Check if response could be cached or Not."""
+        if response.status_code != 200:
+            return False
+        if "no-store" in self.directives(response.headers):
+            return False
+        headers = response.headers
+        if "*" in self.vary(headers, {}):
+            return False
+        return bool(
+            self.ttl(headers) > 0
+            or "ETag" in headers
+            or "Last-Modified" in headers
+        )
+
+    @staticmethod
+    def is_fresh(entry: dict) -> bool:
+        """Check if cached entry still fresh or Not."""
+        return bool(time() - entry["stored"] < entry["ttl"])
+
+    @staticmethod
+    def validators(entry: dict) -> dict[str, str]:
+        """Get conditional request headers for stale entry."""
+        headers = entry["headers"]
+        result: dict[str, str] = {}
+        if "ETag" in headers:
+            result["If-None-Match"] = headers["ETag"]
+        if "Last-Modified" in headers:
+            result["If-Modified-Since"] = headers["Last-Modified"]
+        return result
+
+    def get(self, key: str, request_headers: Any = None) -> dict:
+        """Get cached entry by key, empty dict if not cached.
+
+        Entry of other request header values named by `Vary` not matched.
+        """
+        entry = self.memory.get(key)
+        if entry and entry.get("vary"):
+            sent = CaseInsensitiveDict(request_headers or {})
+            for name, value in entry["vary"].items():
+                if (sent.get(name) or "") != value:
+                    entry = {}
+                    break
+        if entry and self.is_fresh(entry):
+            self.count("hit")
+        else:
+            self.count("miss")
+        return entry
+
+    def set(self, key: str, response: Response, request_headers: Any = None) -> dict:
+        """Cache response by key if storable, return entry or empty dict.
+
+        Values of request headers named by `Vary` are kept with entry.
+        """
+        if not self.storable(response):
+            return {}
+        headers = CaseInsensitiveDict(response.headers)
+        # `Age` is time already spent in upstream caches
+        age = headers.get("Age", "")
+        entry = {
+            "url": response.url,
+            "code": response.status_code,
+            "headers": dict(headers),
+            "encoding": response.encoding,
+            "content": b64encode(response.content).decode(),
+            "stored": time() - (int(age) if age.isdigit() else 0),
+            "ttl": self.ttl(headers),
+            "vary": self.vary(headers, request_headers),
+        }
+        self.memory.set(key=key, value=entry)
+        self.count("stored")
+        return entry
+
+    def refresh(self, key: str, entry: dict, response: Response) -> dict:
+        """Refresh stale entry by `304 Not Modified` response headers."""
+        headers = CaseInsensitiveDict(entry["headers"])
+        headers.update(response.headers)
+        headers.pop("Content-Length", None)
+        entry["headers"] = dict(headers)
+        entry["stored"] = time()
+        entry["ttl"] = self.ttl(headers)
+        self.memory.set(key=key, value=entry)
+        self.count("revalidated")
+        return entry
+
+    def update(
+        self, key: str, entry: dict, response: Response, request_headers: Any = None
+    ) -> Response:
+        """Update cache by response from network, return response to use."""
+        if entry and response.status_code == 304:
+            return self.to_response(self.refresh(key, entry, response))
+        self.set(key, response, request_headers)
+        return response
+
+    @staticmethod
+    def to_response(entry: dict) -> Response:
+        """Build requests Response from cached entry."""
+        response = Response()
+        response.status_code = entry["code"]
+        response.url = entry["url"]
+        response.reason = "OK"
+        response.headers = CaseInsensitiveDict(entry["headers"])
+        response.encoding = entry["encoding"]
+        response._content = b64decode(entry["content"])  # pylint: disable=W0212
+        response._content_consumed = True  # pylint: disable=W0212
+        return response
+
+    def save(self) -> bool:
+        """Save cached responses into file."""
+        return self.memory.save()
+
+    def clear(self) -> None:
+        """Clear all cached responses."""
+        self.memory.clear()
+
+
+class TestHttpCache:
+    """TestCase for HttpCache."""
+
+    file = Path(__file__).parent / "httpcache.json"
+
+    @staticmethod
+    def new_response(code: int, headers: dict, content: bytes = b"") -> Response:
+        """Generate Response for testing."""
+        response = Response()
+        response.status_code = code
+        response.url = "https://example.com/"
+        response.headers = CaseInsensitiveDict(headers)
+        response._content = content  # pylint: disable=W0212
+        return response
+
+    def test_cache(self) -> None:
+        """Test store, fresh hit and revalidate."""
+        self.file.unlink(missing_ok=True)
+        cache = HttpCache(file=self.file)
+        key = cache.key("https://example.com/", {"q": "1"})
+        assert key == "https://example.com/?q=1"
+        assert not cache.get(key)
+
+        response = self.new_response(200, {"Cache-Control": "no-store"}, b"x")
+        assert cache.update(key, {}, response) is response
+        assert not cache.get(key)
+
+        response = self.new_response(
+            200, {"Cache-Control": "max-age=60", "ETag": '"v1"'}, b"hello"
+        )
+        cache.update(key, {}, response)
+        entry = cache.get(key)
+        assert cache.is_fresh(entry)
+        assert cache.to_response(entry).content == b"hello"
+
+        entry["ttl"] = 0
+        assert not cache.is_fresh(entry)
+        assert cache.validators(entry) == {"If-None-Match": '"v1"'}
+
+        response = self.new_response(304, {"Cache-Control": "max-age=120"})
+        response = cache.update(key, entry, response)
+        assert response.status_code == 200
+        assert response.content == b"hello"
+        assert cache.get(key)["ttl"] == 120
+
+        assert cache.stats["revalidated"] == 1
+        assert cache.stats["hit"] == 2
+
+        assert cache.save()
+        other = HttpCache(file=self.file)
+        assert other.get(key)
+        cache.clear()
+        assert cache.save()
+        for item in (cache, other):
+            atexit.unregister(item.save)
+
+    def test_apart(self) -> None:
+        """Test entries apart by credentials and by Vary headers."""
+        cache = HttpCache(file=self.file)
+        url = "https://example.com/"
+        assert not cache.identity({"Accept": "*/*"})
+        alice = cache.identity({"Authorization": "Bearer a"})
+        bob = cache.identity({}, cookies=["sid=b"])
+        assert alice and bob and alice != bob and "Bearer" not in alice
+        keys = {cache.key(url), cache.key(url, identity=alice), cache.key(url, identity=bob)}
+        assert len(keys) == 3
+
+        headers = {"Cache-Control": "max-age=60", "Vary": "Accept-Language"}
+        response = self.new_response(200, headers)
+        cache.update(cache.key(url), {}, response, {"Accept-Language": "en"})
+        assert cache.get(cache.key(url), {"accept-language": "en"})
+        assert not cache.get(cache.key(url), {"Accept-Language": "de"})
+        assert not cache.get(cache.key(url, identity=alice), {"Accept-Language": "en"})
+
+        response = self.new_response(200, {"Cache-Control": "max-age=60", "Vary": "*"})
+        assert not cache.storable(response)
+        cache.clear()
+        atexit.unregister(cache.save)
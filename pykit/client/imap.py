@@ -3,12 +3,22 @@
 import time
 import random
 import ssl
+import codecs
+import binascii
 import imaplib
+import select
+import selectors
+import socketserver
+from contextlib import contextmanager
+from itertools import takewhile
+from pathlib import Path
+from threading import Event, Lock, Thread
 from email import message_from_bytes, message_from_string
-from email.header import decode_header
-from email.message import Message
-from email.utils import parseaddr, parsedate_to_datetime
-from typing import Any, List, Optional, Union, Dict
+from email.header import decode_header, make_header
+from email.message import EmailMessage, Message
+from email.utils import format_datetime, parseaddr, parsedate_to_datetime
+from datetime import datetime, timezone
+from typing import Any, Iterable, Iterator, List, Optional, Union, Dict
 
 import arrow
 import regex as re
@@ -17,9 +27,61 @@ import socks
 
 from ..base.debug import Debugger
 from ..base.proxy import Proxy
+from ..utils.cache import MemoryCache
 
 
-__all__ = ("ImapClient",)
+__all__ = ("ImapClient", "ImapPool", "ImapIdler")
+
+
+# fetch response head, such as `12 (UID 345 BODY[] {678}`
+PATTERN_FETCH_UID = re.compile(rb"\bUID (\d+)")
+# untagged response of message count, such as `* 23 EXISTS`
+PATTERN_EXISTS = re.compile(rb"^\* (\d+) EXISTS", re.I)
+# esearch response, such as `(TAG "A1") UID MIN 1 MAX 9 COUNT 3 ALL 1,5:6`
+PATTERN_ESEARCH = re.compile(rb"\b(MIN|MAX|COUNT|ALL) ([\d:,]+)", re.I)
+# token of fetch response, atom may have section such as `BODY[1.2]<0>`
+PATTERN_FETCH_TOKEN = re.compile(
+    rb'[()]|"(?:[^"\\]|\\.)*"|[^\s()"\[]+(?:\[[^\]]*\](?:<\d+>)?)?'
+)
+# literal size at end of response head, such as `BODY[] {678}`
+PATTERN_LITERAL_SIZE = re.compile(rb"\{\d+\}$")
+# capability response code, such as `[CAPABILITY IMAP4rev1 IDLE] Logged in`
+PATTERN_CAPABILITY = re.compile(rb"^\[CAPABILITY ([^\]]*)\]", re.I)
+
+
+class PartDecoder:
+    """Incremental decoder of MIME part by transfer encoding and charset.
+
+    Encoded bytes may be cut anywhere, incomplete base64 quantum or
+    quoted-printable escape is kept until next feed.
+    """
+
+    __slots__ = ("encoding", "pending", "decoder")
+
+    def __init__(self, encoding: str = "7bit", charset: str = "") -> None:
+        self.encoding = encoding.lower()
+        self.pending = b""
+        try:
+            self.decoder = codecs.getincrementaldecoder(charset or "utf-8")("replace")
+        except LookupError:
+            self.decoder = codecs.getincrementaldecoder("utf-8")("replace")
+
+    def feed(self, data: bytes, final: bool = False) -> str:
+        """decode next encoded bytes into text"""
+        data = self.pending + data
+        if self.encoding == "base64":
+            data = b"".join(data.split())
+            # bytes of part capped by size may end with incomplete quantum
+            cut = len(data) // 4 * 4
+            data, self.pending = data[:cut], data[cut:]
+            data = binascii.a2b_base64(data) if data else b""
+        elif self.encoding == "quoted-printable":
+            cut = len(data) if final else data.rfind(b"=", max(len(data) - 2, 0))
+            if cut < 0:
+                cut = len(data)
+            data, self.pending = data[:cut], data[cut:]
+            data = binascii.a2b_qp(data)
+        return self.decoder.decode(data, final)
 
 
 class SocksIMAP4(imaplib.IMAP4):
@@ -134,6 +196,8 @@ class SocksIMAP4SSL(SocksIMAP4):
 class ImapClient:
     """Imap Client"""
 
+    header_fields = ("DATE", "SUBJECT", "FROM", "TO")
+
     __slots__ = (
         "host",
         "port",
@@ -146,6 +210,10 @@ class ImapClient:
         "folders",
         "conn",
         "encoding",
+        "exists",
+        "idle_tag",
+        "checkpoint",
+        "synced",
     )
 
     def __init__(
@@ -159,6 +227,7 @@ class ImapClient:
         proxy: Optional[Proxy] = None,
         debugger: Optional[Debugger] = None,
         encoding: str = "unicode_escape",
+        checkpoint: Optional[MemoryCache] = None,
     ) -> None:
 
         self.host = host
@@ -173,6 +242,11 @@ class ImapClient:
 
         self.folders = ["Inbox"]
         self.conn: Any = None
+        self.exists = -1  # message count of selected folder
+        self.idle_tag = b""  # tag of IDLE command in progress
+        # last synced state of folders, only new uids searched if set
+        self.checkpoint = checkpoint
+        self.synced: Dict[str, dict] = {}  # state of folders pending commit
 
     def log(self, message: Any) -> None:
         """logging message if demo is True"""
@@ -214,13 +288,53 @@ class ImapClient:
         if self.demo is True:
             self.conn.debug = 4
 
-        return bool(self.conn.login(self.usr, self.pwd))
+        _, data = self.conn.login(self.usr, self.pwd)
+        self.load_capabilities(data)
+        return True
+
+    def load_capabilities(self, data: list) -> None:
+        """refresh capabilities after login, may be changed by server
+
+        From CAPABILITY response code of login if any, otherwise by command.
+        """
+        found = PATTERN_CAPABILITY.match(data[0] if data and data[0] else b"")
+        if found:
+            value = found.group(1)
+        else:
+            flag, data = self.conn.capability()
+            if flag != "OK" or not data or not data[-1]:
+                return
+            value = data[-1]
+        self.conn.capabilities = tuple(value.decode(errors="ignore").upper().split())
 
     def logout(self) -> bool:
-        """logout for imaplib"""
-        if self.conn and self.conn.close():
-            return bool(self.conn.lougout())
-        return False
+        """logout for imaplib, close selected folder first"""
+        if not self.conn:
+            return False
+        try:
+            if self.conn.state == "SELECTED":
+                self.conn.close()
+            return self.conn.logout()[0] == "BYE"
+        except (imaplib.IMAP4.error, OSError):
+            return False
+        finally:
+            self.conn = None
+
+    def is_alive(self) -> bool:
+        """check if connection still logged in by NOOP"""
+        if not self.conn or self.conn.state not in ("AUTH", "SELECTED"):
+            return False
+        try:
+            return self.conn.noop()[0] == "OK"
+        except (imaplib.IMAP4.error, OSError):
+            return False
+
+    def ensure_login(self) -> bool:
+        """reuse logged in connection if alive, otherwise login again"""
+        if self.is_alive():
+            return True
+        self.conn = None
+        return self.login()
 
     @staticmethod
     def is_bytes(obj: Any) -> bool:
@@ -251,29 +365,387 @@ class ImapClient:
                 charset = result.group()
         return charset
 
+    def has_capability(self, name: str) -> bool:
+        """check if server announced capability"""
+        return bool(self.conn and name.upper() in self.conn.capabilities)
+
     def get_uids(self, folder: str, query: str) -> List[str]:
-        """search to get list of email uids"""
-        if self.conn:
-            flag, data = self.conn.select(folder)
-            if flag == "OK":
-                time.sleep(random.uniform(0.05, 0.10))
-                flag, data = self.conn.search(None, query)
-                if flag == "OK":
-                    return [x.decode() for x in data[0].split()]
-        return []
+        """search to get list of email uids, by UID SEARCH on server side
 
-    def get_msg(self, uid: str, timestamp: int = 0) -> dict:
-        """read email message by uid, may filter by timestamp"""
-        result: Dict[str, str] = {}
+        With checkpoint, only uids after the last synced one are searched.
+        """
+        uids: List[str] = []
+        if not self.conn:
+            return uids
+        flag, data = self.conn.select(folder)
+        if flag != "OK":
+            return uids
+        self.exists = int(data[0] or 0)
+        start = self.sync_start(folder) if self.checkpoint is not None else 1
+        if not start:
+            return uids
+        if start > 1:
+            query = f"UID {start}:* {query}"
+        time.sleep(random.uniform(0.05, 0.10))
+        if self.has_capability("ESEARCH"):
+            uids = self.esearch(query).get("ALL", [])
+        else:
+            flag, data = self.conn.uid("SEARCH", query)
+            if flag == "OK" and data and data[0]:
+                uids = [x.decode() for x in data[0].split()]
+        # `n:*` matches the last message even if its uid is less than n
+        return [x for x in uids if int(x) >= start]
+
+    def checkpoint_key(self, folder: str) -> str:
+        """cache key of folder checkpoint"""
+        return f"imap:{self.host}:{self.usr}:{folder}"
+
+    def sync_start(self, folder: str) -> int:
+        """first uid not synced yet of selected folder by checkpoint
 
+        1 if folder never synced or its UIDVALIDITY changed, 0 if no new
+        message since then by UIDNEXT, state kept until `sync_commit`.
+        """
+        responses = self.conn.untagged_responses
+        try:
+            validity = int(responses["UIDVALIDITY"][-1])
+            uid_next = int(responses["UIDNEXT"][-1])
+        except (KeyError, IndexError, ValueError):
+            return 1
+        self.synced[folder] = {"validity": validity, "uid": uid_next - 1}
+        saved = self.checkpoint.get(self.checkpoint_key(folder)) if self.checkpoint else {}
+        if not saved or saved.get("validity") != validity:
+            return 1
+        return saved["uid"] + 1 if uid_next > saved["uid"] + 1 else 0
+
+    def sync_commit(self, folder: str) -> None:
+        """save synced state of folder into checkpoint, call `save` of it to persist"""
+        state = self.synced.pop(folder, None)
+        if state and self.checkpoint is not None:
+            self.checkpoint.set(self.checkpoint_key(folder), state)
+
+    @staticmethod
+    def expand_set(msg_set: str) -> List[str]:
+        """expand message set of ranges into list of ids"""
+        result: List[str] = []
+        for part in msg_set.split(","):
+            start, _, end = part.partition(":")
+            if start:
+                low, high = sorted((int(start), int(end or start)))
+                result.extend(str(num) for num in range(low, high + 1))
+        return result
+
+    def esearch(
+        self, query: str, returns: Iterable[str] = ("MIN", "MAX", "COUNT", "ALL")
+    ) -> dict:
+        """UID SEARCH RETURN (...) of ESEARCH extension on selected folder
+
+        Get MIN/MAX/COUNT as int and ALL as list of uids, missing if no match,
+        the uids are sent as compact set of ranges instead of one by one.
+        """
+        result: dict = {}
         if not self.conn:
             return result
+        flag, _ = self.conn.uid("SEARCH", f"RETURN ({' '.join(returns)})", query)
+        data = self.conn.untagged_responses.pop("ESEARCH", [])
+        if flag != "OK":
+            return result
+        for line in data:
+            for key, value in PATTERN_ESEARCH.findall(line):
+                name = key.decode().upper()
+                if name == "ALL":
+                    result[name] = self.expand_set(value.decode())
+                else:
+                    result[name] = int(value)
+        return result
+
+    def decode_str(self, value: Optional[str]) -> str:
+        """decode RFC2047 encoded header value, plain value kept"""
+        if not value:
+            return ""
+        try:
+            return str(make_header(decode_header(value)))
+        except (LookupError, UnicodeDecodeError):
+            return self._to_str(decode_header(value)[0][0])
+
+    @staticmethod
+    def msg_set(uids: Iterable[str]) -> str:
+        """compress ids into message set of ranges, such as `1:3,5,8:9`"""
+        nums = sorted({int(x) for x in uids})
+        ranges: List[str] = []
+        start = 0
+        for index, num in enumerate(nums):
+            if index + 1 < len(nums) and nums[index + 1] == num + 1:
+                if not start:
+                    start = num
+                continue
+            ranges.append(f"{start}:{num}" if start else str(num))
+            start = 0
+        return ",".join(ranges)
+
+    def fetch_many(
+        self, uids: List[str], items: str, batch: int = 200
+    ) -> Dict[str, bytes]:
+        """fetch items of many messages, one command for each batch of ids"""
+        result: Dict[str, bytes] = {}
+        if not self.conn:
+            return result
+        for index in range(0, len(uids), batch):
+            msg_set = self.msg_set(uids[index:index + batch])
+            flag, data = self.conn.uid("FETCH", msg_set, items)
+            if flag != "OK" or not data:
+                continue
+            for part in data:
+                if isinstance(part, tuple):
+                    found = PATTERN_FETCH_UID.search(part[0])
+                    if found:
+                        result[found.group(1).decode()] = part[1]
+        return result
+
+    def match_header(
+        self, item: bytes, subject: str = "", timestamp: int = 0, sender: str = "", to: str = ""
+    ) -> bool:
+        """check fetched header fields by subject, timestamp, sender and to
 
-        _, data = self.conn.fetch(uid, "(RFC822)")
+        Text matched as substring ignoring case, like SEARCH of IMAP.
+        """
+        msg = message_from_bytes(item)
+        if timestamp and msg["Date"]:
+            try:
+                if parsedate_to_datetime(msg["Date"]).timestamp() < timestamp:
+                    return False
+            except (TypeError, ValueError):
+                pass
+        for key, value in (("Subject", subject), ("From", sender), ("To", to)):
+            if value and value.lower() not in self.decode_str(msg[key]).lower():
+                return False
+        return True
+
+    def get_msg(self, uid: str, timestamp: int = 0, max_bytes: int = 0) -> dict:
+        """read email message by uid, may filter by timestamp
+
+        Only header fields and text part found by BODYSTRUCTURE are fetched,
+        the text part capped to max_bytes if > 0.
+        """
+        return next(iter(self.fetch_msgs([uid], timestamp, max_bytes=max_bytes)), {})
+
+    def get_msg_full(self, uid: str, timestamp: int = 0) -> dict:
+        """read whole email message by uid, may filter by timestamp"""
+        if not self.conn:
+            return {}
+
+        _, data = self.conn.uid("FETCH", uid, "(RFC822)")
         if not _ == "OK" or data is None or data[0] is None:
+            return {}
+        return self.parse_msg(uid, data[0][1], timestamp)
+
+    def fetch_items(
+        self, uids: List[str], items: str, batch: int = 200
+    ) -> Dict[str, dict]:
+        """fetch items of many messages, parsed into dict of each uid"""
+        result: Dict[str, dict] = {}
+        if not self.conn:
             return result
+        for index in range(0, len(uids), batch):
+            msg_set = self.msg_set(uids[index:index + batch])
+            flag, data = self.conn.uid("FETCH", msg_set, items)
+            if flag == "OK" and data:
+                result.update(self.parse_fetch(data))
+        return result
+
+    @staticmethod
+    def parse_fetch(data: Iterable[Any]) -> Dict[str, dict]:
+        """parse FETCH responses of imaplib into items by uid
+
+        Item names are upper case as sent, such as `BODY[1]<0>`, literals
+        kept as bytes, quoted strings and atoms as str, NIL as None.
+        """
+        tokens: List[Any] = []
+        for part in data:
+            if isinstance(part, tuple):
+                tokens.extend(PATTERN_FETCH_TOKEN.findall(PATTERN_LITERAL_SIZE.sub(b"", part[0])))
+                tokens.append((part[1],))  # wrapped, not mistaken for token
+            elif isinstance(part, bytes):
+                tokens.extend(PATTERN_FETCH_TOKEN.findall(part))
+
+        stack: List[list] = [[]]
+        for token in tokens:
+            if isinstance(token, tuple):
+                stack[-1].append(token[0])
+            elif token == b"(":
+                stack.append([])
+            elif token == b")":
+                if len(stack) > 1:
+                    node = stack.pop()
+                    stack[-1].append(node)
+            elif token.startswith(b'"'):
+                value = re.sub(rb"\\(.)", rb"\1", token[1:-1])
+                stack[-1].append(value.decode(errors="replace"))
+            elif token.upper() == b"NIL":
+                stack[-1].append(None)
+            else:
+                stack[-1].append(token.decode(errors="replace"))
+
+        result: Dict[str, dict] = {}
+        for node in stack[0]:
+            if isinstance(node, list):
+                items = {str(key).upper(): value for key, value in zip(node[::2], node[1::2])}
+                if items.get("UID"):
+                    result[items["UID"]] = items
+        return result
+
+    @staticmethod
+    def body_item(items: dict, prefix: str = "BODY[") -> Any:
+        """get first item of name prefix, such as body section of any range"""
+        for key, value in items.items():
+            if key.startswith(prefix):
+                return value
+        return None
+
+    @classmethod
+    def text_parts(cls, node: Any, section: str = "") -> Iterator[tuple]:
+        """walk BODYSTRUCTURE, yield (section, subtype, encoding, charset) of text parts
+
+        nested message/rfc822 skipped, single part message is section 1
+        """
+        if not isinstance(node, list) or not node:
+            return
+        if isinstance(node[0], list):
+            children = takewhile(lambda x: isinstance(x, list), node)
+            for index, child in enumerate(children, 1):
+                yield from cls.text_parts(child, f"{section}.{index}" if section else str(index))
+        elif len(node) > 6 and str(node[0]).lower() == "text":
+            params = node[2] if isinstance(node[2], list) else []
+            pairs = {str(key).lower(): value for key, value in zip(params[::2], params[1::2])}
+            yield (
+                section or "1",
+                str(node[1]).lower(),
+                str(node[5] or "7bit").lower(),
+                pairs.get("charset") or "",
+            )
+
+    @classmethod
+    def text_part(cls, structure: Any) -> Optional[tuple]:
+        """text/plain part of BODYSTRUCTURE, text/html if no plain"""
+        parts = [x for x in cls.text_parts(structure) if x[1] in ("plain", "html")]
+        if not parts:
+            return None
+        return min(parts, key=lambda x: x[1] != "plain")
+
+    def header_msg(self, uid: str, header: bytes, body: str = "") -> dict:
+        """build message dict of fetched header fields and decoded body"""
+        msg = message_from_bytes(header)
+        _, e_from = parseaddr(msg["From"] or "")
+        _, e_to = parseaddr(msg["To"] or "")
+        return {
+            "uid": uid,
+            "date": self._to_str(msg["Date"] or ""),
+            "subject": self._to_str(self.decode_str(msg["Subject"])),
+            "from": self._to_str(e_from),
+            "to": self._to_str(e_to),
+            "body": body,
+        }
+
+    def fetch_msgs(
+        self,
+        uids: List[str],
+        timestamp: int = 0,
+        subject: str = "",
+        max_bytes: int = 0,
+        batch: int = 200,
+        sender: str = "",
+        to: str = "",
+    ) -> List[dict]:
+        """fetch messages of uids in batch, order kept
+
+        BODYSTRUCTURE and header fields first, filtered by subject,
+        timestamp, sender and to, then text part of matched ones only, in
+        one command for each batch of the same section, capped to max_bytes
+        if > 0.
+        """
+        fields = " ".join(self.header_fields)
+        heads = self.fetch_items(
+            uids, f"(BODYSTRUCTURE BODY.PEEK[HEADER.FIELDS ({fields})])", batch
+        )
+        parts: Dict[str, tuple] = {}
+        sections: Dict[str, List[str]] = {}
+        full: List[str] = []
+        for uid in uids:
+            header = self.body_item(heads.get(uid, {}))
+            if not isinstance(header, bytes) or not self.match_header(
+                header, subject, timestamp, sender, to
+            ):
+                continue
+            part = self.text_part(heads[uid].get("BODYSTRUCTURE"))
+            if part:
+                parts[uid] = part
+                sections.setdefault(part[0], []).append(uid)
+            elif "BODYSTRUCTURE" not in heads[uid]:
+                full.append(uid)
+
+        size = f"<0.{max_bytes}>" if max_bytes > 0 else ""
+        texts: Dict[str, Any] = {}
+        for section, group in sections.items():
+            for uid, items in self.fetch_items(group, f"(BODY.PEEK[{section}]{size})", batch).items():
+                texts[uid] = self.body_item(items)
+        bodies = self.fetch_many(full, "(BODY.PEEK[])", batch)
+
+        result = []
+        for uid in uids:
+            if uid in parts:
+                _, _, encoding, charset = parts[uid]
+                data = texts.get(uid)
+                body = PartDecoder(encoding, charset).feed(data, True) if data else ""
+                result.append(self.header_msg(uid, self.body_item(heads[uid]), body))
+            elif uid in bodies:
+                result.append(self.parse_msg(uid, bodies[uid], timestamp))
+        return result
+
+    @staticmethod
+    def scan_text(pattern: Pattern, text: str, result: list, final: bool) -> str:
+        """collect matches like findall, return tail of text kept for next chunk
+
+        match cut by end of text is found by partial matching of regex
+        """
+        for found in pattern.finditer(text, partial=not final):
+            if found.partial:
+                return text[found.start():]
+            if not pattern.groups:
+                result.append(found.group())
+            else:
+                result.append(found.group(1) if pattern.groups == 1 else found.groups())
+        return ""
+
+    def scan_msg(
+        self, uid: str, pattern: Pattern, chunk: int = 16384, max_bytes: int = 0
+    ) -> list:
+        """findall of pattern over text part of message fetched chunk by chunk
+
+        regex run on each chunk as it arrives, stop at max_bytes if > 0
+        """
+        items = self.fetch_items([uid], "(BODYSTRUCTURE)").get(uid, {})
+        part = self.text_part(items.get("BODYSTRUCTURE"))
+        if not part:
+            return []
+        section, _, encoding, charset = part
+        decoder = PartDecoder(encoding, charset)
+        result: list = []
+        text, offset = "", 0
+        while True:
+            size = min(chunk, max_bytes - offset) if max_bytes > 0 else chunk
+            items = self.fetch_items([uid], f"(BODY.PEEK[{section}]<{offset}.{size}>)")
+            data = self.body_item(items.get(uid, {}))
+            data = data if isinstance(data, bytes) else b""
+            offset += len(data)
+            final = len(data) < size or 0 < max_bytes <= offset
+            text = self.scan_text(pattern, text + decoder.feed(data, final), result, final)
+            if final:
+                return result
+
+    def parse_msg(self, uid: str, item: Any, timestamp: int = 0) -> dict:
+        """parse fetched email message, may filter by timestamp"""
+        result: Dict[str, str] = {}
 
-        item = data[0][1]
         if self.is_bytes(item):
             msg = message_from_bytes(bytes(item))
         else:
@@ -286,9 +758,7 @@ class ImapClient:
 
         _, e_from = parseaddr(msg["From"])
         _, e_to = parseaddr(msg["To"])
-        e_sub = decode_header(msg["Subject"])[0][0].decode(
-            encoding=self.encoding, errors="ignore"
-        )
+        e_sub = self.decode_str(msg["Subject"])
 
         self.log(f"Raw date: {e_date}")
         self.log(f"Subject: {e_sub}")
@@ -305,7 +775,7 @@ class ImapClient:
         else:
             e_body = e_body.decode()
 
-        e_date = self._to_str(msg["Date"])
+        e_date = self._to_str(e_date)
         e_sub = self._to_str(e_sub)
         e_from = self._to_str(e_from)
         e_to = self._to_str(e_to)
@@ -320,19 +790,41 @@ class ImapClient:
         }
 
     def lookup(
-        self, query: str, pattern: Pattern, timestamp: int = 0, debug: bool = False
+        self,
+        query: str,
+        pattern: Pattern,
+        timestamp: int = 0,
+        debug: bool = False,
+        subject: str = "",
+        batch: int = 200,
+        max_bytes: int = 0,
+        sender: str = "",
+        to: str = "",
     ) -> list:
-        """lookup through mailbox and filter email content by regex"""
-        result = []
+        """lookup through mailbox and filter email content by regex
+
+        With batch > 0, header fields of messages are fetched by batch of
+        ids in one command, otherwise one fetch per message, then filtered
+        by subject, timestamp, sender and to locally, as non-ascii ones not
+        searched by server, then text parts of candidates only.
+        Text parts capped to max_bytes if > 0.
+        """
+        result: list = []
         for folder in self.folders:
-            uids = self.get_uids(folder, query)
-            for index, uid in enumerate(reversed(uids)):
-                self.log(f"<index={index}> - <uid={uid}>")
-                msg_data = self.get_msg(uid, timestamp)
+            uids = list(reversed(self.get_uids(folder, query)))
+            if batch > 0:
+                messages = self.fetch_msgs(uids, timestamp, subject, max_bytes, batch, sender, to)
+            else:
+                messages = (
+                    msg for uid in uids
+                    for msg in self.fetch_msgs([uid], timestamp, subject, max_bytes, 1, sender, to)
+                )
+            for index, msg_data in enumerate(messages):
                 if not msg_data:
                     continue
+                self.log(f"<index={index}> - <uid={msg_data['uid']}>")
                 if debug:
-                    print(f"index={index} - uid={uid}")
+                    print(f"index={index} - uid={msg_data['uid']}")
                     print(msg_data)
                     if self.debugger:
                         self.debugger.id_add()
@@ -341,6 +833,7 @@ class ImapClient:
                     continue
                 res = pattern.findall(msg_data["body"])
                 result.extend(res)
+            self.sync_commit(folder)
         return list(set(result))
 
     @staticmethod
@@ -351,6 +844,30 @@ class ImapClient:
             return arrow.get(time_stamp).format(fmt)
         return arrow.now().shift(days=-days).format(fmt)
 
+    @staticmethod
+    def quote(value: str) -> str:
+        """quote string for IMAP command"""
+        value = value.replace("\\", "\\\\").replace('"', '\\"')
+        return f'"{value}"'
+
+    def build_query(
+        self,
+        from_email: str = "",
+        to_email: str = "",
+        subject: str = "",
+        time_stamp: int = 0,
+    ) -> str:
+        """build compound search query, empty and non-ascii values skipped
+
+        no date filter if time_stamp is 0, non-ascii values are filtered
+        locally by lookup instead
+        """
+        parts = [f"SINCE {self._date_str(time_stamp=time_stamp)}"] if time_stamp else []
+        for key, value in (("FROM", from_email), ("TO", to_email), ("SUBJECT", subject)):
+            if value and value.isascii():
+                parts.append(f"{key} {self.quote(value)}")
+        return f"({' '.join(parts)})" if parts else "ALL"
+
     def search(
         self,
         from_email: str,
@@ -362,12 +879,12 @@ class ImapClient:
         debug: bool = False,
     ) -> List[str]:
         """search email by various filters"""
-        date_str = self._date_str(time_stamp=time_stamp)
-        query = f'(SINCE {date_str} FROM "{from_email}" TO "{to_email}" SUBJECT "{subject}")'
-        query = f'SUBJECT "{subject}"'
+        query = self.build_query(from_email, to_email, subject, time_stamp)
         for _ in range(retry):
-            if self.login():
-                results = self.lookup(query, pattern, time_stamp, debug)
+            if self.ensure_login():
+                results = self.lookup(
+                    query, pattern, time_stamp, debug, subject, sender=from_email, to=to_email
+                )
                 if results:
                     return results
             if debug:
@@ -375,6 +892,127 @@ class ImapClient:
             time.sleep(60)
         return []
 
+    def idle_start(self, folder: str = "Inbox") -> bool:
+        """select folder and enter IDLE, server pushes changes until done
+
+        imaplib has no IDLE before Python 3.14, command sent manually.
+        """
+        if not self.has_capability("IDLE"):
+            return False
+        flag, data = self.conn.select(folder)
+        if flag != "OK":
+            return False
+        self.exists = int(data[0] or 0)
+        tag = self.conn._new_tag()  # pylint: disable=W0212
+        self.conn.send(tag + b" IDLE\r\n")
+        while True:
+            line = self.readline()
+            if line.startswith(b"+"):
+                self.idle_tag = tag
+                return True
+            if line.startswith(tag):
+                self.conn.tagged_commands.pop(tag, None)
+                return False
+            self.idle_line(line)
+
+    def readline(self) -> bytes:
+        """read response line, raise abort if connection closed"""
+        line = self.conn.readline()
+        if not line:
+            raise imaplib.IMAP4.abort("socket error: EOF")
+        return line
+
+    def idle_line(self, line: bytes) -> bool:
+        """handle untagged response while idling, True if new message arrived"""
+        found = PATTERN_EXISTS.match(line)
+        if found:
+            count = int(found.group(1))
+            new = count > self.exists
+            self.exists = count
+            return new
+        if line.startswith(b"* BYE"):
+            raise imaplib.IMAP4.abort(line.decode(errors="ignore").strip())
+        return False
+
+    def idle_ready(self) -> bool:
+        """check if response readable without blocking, buffered or on socket"""
+        sock = self.conn.sock
+        if isinstance(sock, ssl.SSLSocket) and sock.pending():
+            return True
+        timeout = sock.gettimeout()
+        sock.settimeout(0)
+        try:
+            # non-blocking peek fills read buffer of imaplib with data arrived
+            if self.conn.file.peek(1):
+                return True
+        except (BlockingIOError, ssl.SSLWantReadError):
+            return False
+        finally:
+            sock.settimeout(timeout)
+        # peek is empty on EOF too, socket then still readable
+        return bool(select.select([sock], [], [], 0)[0])
+
+    def idle_poll(self) -> bool:
+        """read pushed responses while idling, True if new message arrived"""
+        new = False
+        while self.idle_ready():
+            new = self.idle_line(self.readline()) or new
+        return new
+
+    def idle_done(self) -> bool:
+        """leave IDLE, True if new message arrived meanwhile"""
+        if not self.idle_tag:
+            return False
+        tag, self.idle_tag = self.idle_tag, b""
+        self.conn.send(b"DONE\r\n")
+        new = False
+        while True:
+            line = self.readline()
+            if line.startswith(tag):
+                break
+            new = self.idle_line(line) or new
+        self.conn.tagged_commands.pop(tag, None)
+        return new
+
+    def wait_search(
+        self,
+        from_email: str,
+        to_email: str,
+        subject: str,
+        pattern: re.Pattern,
+        time_stamp: int = 0,
+        timeout: float = 300.0,
+        poll: float = 60.0,
+        debug: bool = False,
+    ) -> List[str]:
+        """search email, then wait for new ones pushed by IDLE until timeout
+
+        Fallback to search every poll seconds if server without IDLE,
+        login and IDLE again if connection dropped while idling.
+        """
+        query = self.build_query(from_email, to_email, subject, time_stamp)
+        deadline = time.time() + timeout
+        idler = ImapIdler()
+        try:
+            while self.ensure_login():
+                results = self.lookup(
+                    query, pattern, time_stamp, debug, subject, sender=from_email, to=to_email
+                )
+                remaining = deadline - time.time()
+                if results or remaining <= 0:
+                    return results
+                seen = self.exists
+                if not idler.add(self, self.folders[0]):
+                    time.sleep(min(poll, remaining))
+                    continue
+                if self.exists <= seen:
+                    idler.wait(remaining)
+                idler.remove(self)
+                idler.dead.clear()
+        finally:
+            idler.close()
+        return []
+
     def example(self) -> List[str]:
         """
         show case for search substack password reset url
@@ -400,3 +1038,754 @@ class ImapClient:
             retry=6,
             debug=True,
         )
+
+
+class ImapPool:
+    """Pool of logged in ImapClient keyed by (host, user, proxy).
+
+    Idle clients are kept alive by NOOP every `keepalive` seconds in a
+    background thread, and logged out after `max_idle` seconds unused.
+    Dead connections are replaced by new login when acquired.
+    """
+
+    def __init__(
+        self,
+        keepalive: float = 60.0,
+        max_idle: float = 600.0,
+        demo: bool = False,
+    ) -> None:
+        """Init IMAP Pool, start keepalive thread if keepalive > 0."""
+        self.keepalive = keepalive
+        self.max_idle = max_idle
+        self.demo = demo
+
+        self._lock = Lock()
+        # idle clients of key, with time of last used
+        self._idle: Dict[tuple, List[tuple[ImapClient, float]]] = {}
+        self._stop = Event()
+        self._thread: Optional[Thread] = None
+        if keepalive > 0:
+            self._thread = Thread(target=self._run, name="imap-pool", daemon=True)
+            self._thread.start()
+
+    @staticmethod
+    def key(client: ImapClient) -> tuple:
+        """Get pool key of client."""
+        proxy = client.proxy.url if client.proxy else ""
+        return client.host, client.usr, proxy
+
+    def acquire(
+        self,
+        host: str,
+        port: int,
+        usr: str,
+        pwd: str,
+        ssl_enable: bool = True,
+        proxy: Optional[Proxy] = None,
+    ) -> ImapClient:
+        """Get logged in client of key, reused if any alive, login if none."""
+        client = ImapClient(
+            host, port, usr, pwd, ssl_enable=ssl_enable, demo=self.demo, proxy=proxy
+        )
+        with self._lock:
+            entries = self._idle.get(self.key(client), [])
+            if entries:
+                client, _ = entries.pop()
+        client.ensure_login()
+        return client
+
+    def release(self, client: ImapClient, broken: bool = False) -> None:
+        """Return client into pool, logout it if broken."""
+        if broken or not client.conn:
+            client.logout()
+            return
+        with self._lock:
+            self._idle.setdefault(self.key(client), []).append((client, time.time()))
+
+    @contextmanager
+    def client(
+        self,
+        host: str,
+        port: int,
+        usr: str,
+        pwd: str,
+        ssl_enable: bool = True,
+        proxy: Optional[Proxy] = None,
+    ) -> Iterator[ImapClient]:
+        """Context of pooled client, dropped on connection error.
+
+        Client always returned into pool on exit, on any other error too.
+        """
+        client = self.acquire(host, port, usr, pwd, ssl_enable, proxy)
+        broken = False
+        try:
+            yield client
+        except (imaplib.IMAP4.abort, OSError):
+            broken = True
+            raise
+        finally:
+            self.release(client, broken)
+
+    def ping(self) -> None:
+        """NOOP idle clients, logout dead and expired ones."""
+        now = time.time()
+        with self._lock:
+            entries = [x for items in self._idle.values() for x in items]
+            self._idle.clear()
+        alive = []
+        for client, used in entries:
+            if now - used < self.max_idle and client.is_alive():
+                alive.append((client, used))
+            else:
+                client.logout()
+        with self._lock:
+            for client, used in alive:
+                self._idle.setdefault(self.key(client), []).append((client, used))
+
+    def _run(self) -> None:
+        """Background loop of keepalive."""
+        while not self._stop.wait(self.keepalive):
+            self.ping()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return sum(len(x) for x in self._idle.values())
+
+    def close(self) -> None:
+        """Stop keepalive thread and logout all idle clients."""
+        self._stop.set()
+        with self._lock:
+            entries = [x for items in self._idle.values() for x in items]
+            self._idle.clear()
+        for client, _ in entries:
+            client.logout()
+
+
+class ImapIdler:
+    """Watch many mailboxes for new messages by IDLE in one thread.
+
+    IDLE is renewed every `renew` seconds, under 29 minutes as RFC 2177
+    suggested, clients dropped by connection error are kept in `dead`.
+    """
+
+    def __init__(self, renew: float = 25 * 60) -> None:
+        """Init IMAP Idler."""
+        self.renew = renew
+        self.selector = selectors.DefaultSelector()
+        self.clients: Dict[ImapClient, tuple[str, float]] = {}  # folder, start
+        self.dead: List[ImapClient] = []
+        self.pending: List[ImapClient] = []  # got new message while renewing
+
+    def add(self, client: ImapClient, folder: str = "Inbox") -> bool:
+        """Start IDLE of client on folder, False if not supported."""
+        if not client.idle_start(folder):
+            return False
+        self.selector.register(client.conn.sock, selectors.EVENT_READ, client)
+        self.clients[client] = (folder, time.time())
+        return True
+
+    def remove(self, client: ImapClient) -> bool:
+        """Stop IDLE of client, True if new message arrived meanwhile."""
+        if client not in self.clients:
+            return False
+        del self.clients[client]
+        self.selector.unregister(client.conn.sock)
+        return client.idle_done()
+
+    def drop(self, client: ImapClient) -> None:
+        """Drop client of broken connection."""
+        self.clients.pop(client, None)
+        try:
+            self.selector.unregister(client.conn.sock)
+        except (KeyError, ValueError):
+            pass
+        client.idle_tag = b""
+        try:
+            client.conn.shutdown()
+        except OSError:
+            pass
+        client.conn = None
+        self.dead.append(client)
+
+    def poll(self) -> List[ImapClient]:
+        """Read pushed responses of all clients, get ones with new message."""
+        ready, self.pending = self.pending, []
+        for client in list(self.clients):
+            try:
+                if client.idle_poll() and client not in ready:
+                    ready.append(client)
+            except (imaplib.IMAP4.abort, OSError):
+                self.drop(client)
+        return ready
+
+    def refresh(self) -> None:
+        """Renew IDLE of clients idling too long."""
+        now = time.time()
+        for client, (folder, start) in list(self.clients.items()):
+            if now - start < self.renew:
+                continue
+            try:
+                if self.remove(client):
+                    self.pending.append(client)
+                self.add(client, folder)
+            except (imaplib.IMAP4.abort, OSError):
+                self.drop(client)
+
+    def wait(self, timeout: float) -> List[ImapClient]:
+        """Block until some clients got new message or timeout, get them.
+
+        Return empty at once if connections of all clients dropped.
+        """
+        deadline = time.time() + timeout
+        while True:
+            ready = self.poll()
+            if ready:
+                return ready
+            self.refresh()
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return []
+            if not self.clients:
+                return []
+            self.selector.select(min(remaining, self.renew))
+
+    def close(self) -> None:
+        """Stop IDLE of all clients."""
+        for client in list(self.clients):
+            try:
+                self.remove(client)
+            except (imaplib.IMAP4.abort, OSError):
+                self.drop(client)
+        self.selector.close()
+
+
+class TestImapClient:
+    """TestCase for ImapClient with local IMAP stand-in server."""
+
+    class Server(socketserver.ThreadingTCPServer):
+        """IMAP stand-in server of one mailbox, records received commands."""
+
+        daemon_threads = True
+
+        def __init__(self, capabilities: Iterable[str] = ()) -> None:
+            super().__init__(("127.0.0.1", 0), TestImapClient.Handler)
+            self.capabilities = ["IMAP4rev1", *capabilities]
+            self.messages: List[tuple[int, bytes]] = []  # (uid, raw)
+            self.commands: List[str] = []
+            self.uid_validity = 1
+            self.lock = Lock()
+            self.active = 0
+            self.peak = 0  # max connections at the same time
+            self.drop_idle = 0  # connections to drop while idling
+            self.login_capabilities: List[str] = []  # announced after login only
+            self.capability_code = False  # login reply with CAPABILITY code
+
+        def process_request_thread(self, request: Any, client_address: Any) -> None:
+            with self.lock:
+                self.active += 1
+                self.peak = max(self.peak, self.active)
+            try:
+                super().process_request_thread(request, client_address)
+            finally:
+                with self.lock:
+                    self.active -= 1
+
+        def add(self, subject: str, body: str, days: int = 0, **kwargs: str) -> int:
+            """Add plain text message, with html alternative or html only, return uid."""
+            msg = EmailMessage()
+            msg["Subject"] = subject
+            msg["From"] = kwargs.get("sender", "noreply@example.com")
+            msg["To"] = kwargs.get("to", "user@example.com")
+            date = arrow.now().shift(days=-days).datetime
+            msg["Date"] = format_datetime(date)
+            if body or not kwargs.get("html"):
+                msg.set_content(body, cte=kwargs.get("cte"))
+                if kwargs.get("html"):
+                    msg.add_alternative(kwargs["html"], subtype="html")
+            else:
+                msg.set_content(kwargs["html"], subtype="html")
+            uid = self.messages[-1][0] + 1 if self.messages else 1
+            self.messages.append((uid, msg.as_bytes()))
+            return uid
+
+        def serve(self) -> int:
+            """Serve in background thread, return port."""
+            Thread(target=self.serve_forever, daemon=True).start()
+            return self.server_address[1]
+
+    class Handler(socketserver.StreamRequestHandler):
+        """Minimal IMAP4rev1 commands of one mailbox."""
+
+        server: "TestImapClient.Server"
+
+        def send(self, line: Union[str, bytes]) -> None:
+            """Send line with CRLF."""
+            data = line.encode() if isinstance(line, str) else line
+            self.wfile.write(data + b"\r\n")
+
+        def handle(self) -> None:
+            """Read tagged commands until logout."""
+            self.send("* OK IMAP4rev1 stand-in ready")
+            while True:
+                line = self.rfile.readline().decode().rstrip("\r\n")
+                if not line:
+                    return
+                tag, _, rest = line.partition(" ")
+                command, _, args = rest.partition(" ")
+                uid = command.upper() == "UID"
+                if uid:
+                    command, _, args = args.partition(" ")
+                self.server.commands.append(f"{'UID ' if uid else ''}{command.upper()} {args}")
+                method = getattr(self, f"do_{command.lower()}", None)
+                if method is None:
+                    self.send(f"{tag} BAD unknown command")
+                elif method(tag, args, uid) is False:
+                    return
+
+        def capabilities(self) -> str:
+            """Capabilities of current state."""
+            names = self.server.capabilities
+            if getattr(self, "authed", False):
+                names = names + self.server.login_capabilities
+            return " ".join(names)
+
+        def do_capability(self, tag: str, args: str, uid: bool) -> None:
+            """CAPABILITY"""
+            self.send(f"* CAPABILITY {self.capabilities()}")
+            self.send(f"{tag} OK CAPABILITY completed")
+
+        def do_login(self, tag: str, args: str, uid: bool) -> None:
+            """LOGIN"""
+            self.authed = True
+            if self.server.capability_code:
+                self.send(f"{tag} OK [CAPABILITY {self.capabilities()}] LOGIN completed")
+            else:
+                self.send(f"{tag} OK LOGIN completed")
+
+        def do_select(self, tag: str, args: str, uid: bool) -> None:
+            """SELECT"""
+            messages = self.server.messages
+            uid_next = messages[-1][0] + 1 if messages else 1
+            self.exists = len(messages)  # pushed by IDLE once changed
+            self.send(f"* {len(messages)} EXISTS")
+            self.send(f"* OK [UIDVALIDITY {self.server.uid_validity}] UIDs valid")
+            self.send(f"* OK [UIDNEXT {uid_next}] Predicted next UID")
+            self.send(f"{tag} OK [READ-WRITE] SELECT completed")
+
+        do_examine = do_select
+
+        def do_idle(self, tag: str, args: str, uid: bool) -> Optional[bool]:
+            """IDLE, push EXISTS when message added since SELECT until DONE"""
+            count = self.exists
+            self.send("+ idling")
+            if self.server.drop_idle:
+                self.server.drop_idle -= 1
+                time.sleep(0.1)
+                return False
+            while True:
+                if len(self.server.messages) != count:
+                    count = len(self.server.messages)
+                    self.send(f"* {count} EXISTS")
+                readable, _, _ = select.select([self.connection], [], [], 0.05)
+                if readable:
+                    line = self.rfile.readline().strip().upper()
+                    if line == b"DONE" or not line:
+                        break
+            self.send(f"{tag} OK IDLE terminated")
+
+        def do_noop(self, tag: str, args: str, uid: bool) -> None:
+            """NOOP"""
+            self.send(f"{tag} OK NOOP completed")
+
+        def do_close(self, tag: str, args: str, uid: bool) -> None:
+            """CLOSE"""
+            self.send(f"{tag} OK CLOSE completed")
+
+        def do_logout(self, tag: str, args: str, uid: bool) -> bool:
+            """LOGOUT"""
+            self.send("* BYE logging out")
+            self.send(f"{tag} OK LOGOUT completed")
+            return False
+
+        def match(self, num: int, raw: bytes, criteria: List[str]) -> bool:
+            """Check message by search criteria of ALL/UID/SINCE/FROM/TO/SUBJECT."""
+            msg = message_from_bytes(raw)
+            tokens = iter(criteria)
+            for token in tokens:
+                key = token.upper()
+                if key == "UID":
+                    if not self.in_set(num, next(tokens)):
+                        return False
+                elif key in ("SINCE", "FROM", "TO", "SUBJECT"):
+                    value = re.sub(r'\\(.)', r"\1", next(tokens).strip('"'))
+                    if key == "SINCE":
+                        date = datetime.strptime(value, "%d-%b-%Y").date()
+                        if parsedate_to_datetime(msg["Date"]).date() < date:
+                            return False
+                    elif value.lower() not in str(msg[key.title()]).lower():
+                        return False
+            return True
+
+        def do_search(self, tag: str, args: str, uid: bool) -> None:
+            """SEARCH, with RETURN options of ESEARCH"""
+            returns = re.match(r"RETURN \(([^)]*)\) ", args, flags=re.I)
+            if returns:
+                args = args[returns.end():]
+            criteria = re.findall(r'"(?:[^"\\]|\\.)*"|[^\s()]+', args)
+            found = [
+                num if uid else index
+                for index, (num, raw) in enumerate(self.server.messages, 1)
+                if self.match(num, raw, criteria)
+            ]
+            if not returns:
+                self.send(" ".join(["* SEARCH", *map(str, found)]))
+            else:
+                line = f'* ESEARCH (TAG "{tag}"){" UID" if uid else ""}'
+                if found:
+                    values = {
+                        "MIN": str(min(found)),
+                        "MAX": str(max(found)),
+                        "COUNT": str(len(found)),
+                        "ALL": ImapClient.msg_set(map(str, found)),
+                    }
+                    for key in returns.group(1).upper().split():
+                        line += f" {key} {values[key]}"
+                self.send(line)
+            self.send(f"{tag} OK SEARCH completed")
+
+        @staticmethod
+        def in_set(num: int, msg_set: str) -> bool:
+            """Check if number in message set."""
+            for part in msg_set.split(","):
+                start, _, end = part.partition(":")
+                low = int(start)
+                high = low if not end else (2 ** 32 if end == "*" else int(end))
+                if min(low, high) <= num <= max(low, high):
+                    return True
+            return False
+
+        @staticmethod
+        def section(raw: bytes, name: str) -> bytes:
+            """Get body section of message, header fields or part number."""
+            if not name:
+                return raw
+            msg = message_from_bytes(raw)
+            fields = re.search(r"HEADER\.FIELDS \(([^)]*)\)", name.upper())
+            if fields:
+                lines = [
+                    f"{key}: {msg[key]}\r\n"
+                    for key in fields.group(1).split() if msg[key] is not None
+                ]
+                return ("".join(lines) + "\r\n").encode()
+            for num in name.split("."):
+                if msg.is_multipart():
+                    msg = msg.get_payload(int(num) - 1)
+            return str(msg.get_payload()).encode()
+
+        @classmethod
+        def structure(cls, msg: Message) -> str:
+            """Get BODYSTRUCTURE of message."""
+            if msg.is_multipart():
+                children = "".join(cls.structure(x) for x in msg.get_payload())
+                return f'({children} "{msg.get_content_subtype().upper()}")'
+            params = " ".join(f'"{key.upper()}" "{value}"' for key, value in msg.get_params()[1:])
+            encoding = msg["Content-Transfer-Encoding"] or "7bit"
+            payload = str(msg.get_payload())
+            return (
+                f'("{msg.get_content_maintype().upper()}" "{msg.get_content_subtype().upper()}" '
+                f'({params}) NIL NIL "{encoding.upper()}" {len(payload)} {payload.count(chr(10))})'
+            )
+
+        def do_fetch(self, tag: str, args: str, uid: bool) -> None:
+            """FETCH body sections of any range, BODYSTRUCTURE"""
+            msg_set, _, items = args.partition(" ")
+            sections = re.findall(
+                r"BODY(?:\.PEEK)?\[([^\]]*)\](?:<(\d+)\.(\d+)>)?", items, flags=re.I
+            )
+            if "RFC822" in items.upper() and not sections:
+                sections = [("", "", "")]
+            for index, (num, raw) in enumerate(self.server.messages, 1):
+                if not self.in_set(num if uid else index, msg_set):
+                    continue
+                head = f"* {index} FETCH (UID {num}"
+                if "BODYSTRUCTURE" in items.upper():
+                    head += f" BODYSTRUCTURE {self.structure(message_from_bytes(raw))}"
+                data = b""
+                for name, start, size in sections:
+                    content = self.section(raw, name)
+                    if start:
+                        content = content[int(start):int(start) + int(size)]
+                        name += f"]<{start}>"
+                    else:
+                        name += "]"
+                    data += f" BODY[{name} {{{len(content)}}}\r\n".encode() + content
+                self.wfile.write(head.encode() + data + b")\r\n")
+            self.send(f"{tag} OK FETCH completed")
+
+    def new_server(self, capabilities: Iterable[str] = ()) -> "TestImapClient.Server":
+        """Start stand-in server with sample messages."""
+        server = self.Server(capabilities)
+        server.add("Old verify", "https://example.com/verify/old", days=30)
+        for index in range(20):
+            server.add(f"Newsletter {index}", "nothing here " * 100)
+        server.add("Verify your email address", "link: https://example.com/verify/abc")
+        server.serve()
+        return server
+
+    @staticmethod
+    def new_client(server: "TestImapClient.Server") -> ImapClient:
+        """Login ImapClient into stand-in server."""
+        client = ImapClient(
+            host="127.0.0.1",
+            port=server.server_address[1],
+            usr="user@example.com",
+            pwd="password",
+            ssl_enable=False,
+            demo=False,
+        )
+        assert client.login()
+        return client
+
+    def test_lookup_batch(self) -> None:
+        """Test batched header fetch and body fetch of candidates only."""
+        server = self.new_server()
+        client = self.new_client(server)
+        pattern = re.compile(r"https://example\.com/verify/\w+")
+        timestamp = int(arrow.now().shift(days=-1).timestamp())
+
+        server.commands.clear()
+        urls = client.lookup("ALL", pattern, timestamp, subject="verify")
+        assert urls == ["https://example.com/verify/abc"]
+        fetches = [x for x in server.commands if x.startswith("UID FETCH")]
+        assert fetches == [
+            "UID FETCH 1:22 (BODYSTRUCTURE BODY.PEEK[HEADER.FIELDS (DATE SUBJECT FROM TO)])",
+            "UID FETCH 22 (BODY.PEEK[1])",
+        ]
+
+        # one fetch per message without batch
+        server.commands.clear()
+        urls = client.lookup("ALL", pattern, timestamp, batch=0)
+        assert urls == ["https://example.com/verify/abc"]
+        # header with structure of each, then text part of 21 not too old
+        assert len([x for x in server.commands if x.startswith("UID FETCH")]) == 22 + 21
+        server.shutdown()
+
+    def test_partial(self) -> None:
+        """Test text part fetched by BODYSTRUCTURE, capped or by chunks."""
+        server = self.new_server()
+        link = "https://example.com/verify/" + "abc" * 5
+        text = "x " * 3000 + link + "\n"
+        uid = server.add("Verify", text, cte="base64", html=f"<a href='{link}'>verify</a>")
+        html = server.add("Verify", "", html=f"<p>{link}</p>")
+        client = self.new_client(server)
+        client.conn.select("Inbox")
+
+        server.commands.clear()
+        msg = client.get_msg(str(uid))
+        assert msg["subject"] == "Verify" and msg["body"] == text
+        assert server.commands[-1] == f"UID FETCH {uid} (BODY.PEEK[1])"
+        assert client.get_msg(str(html))["body"] == f"<p>{link}</p>\n"
+
+        msg = client.get_msg(str(uid), max_bytes=103)
+        # 103 bytes of base64 lines: 100 chars without newline, 75 bytes decoded
+        assert msg["body"] == text[:75]
+        assert server.commands[-1] == f"UID FETCH {uid} (BODY.PEEK[1]<0.103>)"
+
+        pattern = re.compile(r"https://example\.com/verify/(\w+)")
+        for chunk in (500, 777, 8192):
+            assert client.scan_msg(str(uid), pattern, chunk) == ["abc" * 5]
+        assert not client.scan_msg(str(uid), pattern, 500, max_bytes=4000)
+
+        items = client.parse_fetch([
+            (b'1 (UID 7 BODY[HEADER.FIELDS (SUBJECT)] {9}', b"Subject:)"),
+            b' BODYSTRUCTURE ("TEXT" "PLAIN" ("CHARSET" "utf-8") NIL NIL "7BIT" 1 1))',
+        ])
+        assert items["7"]["BODY[HEADER.FIELDS (SUBJECT)]"] == b"Subject:)"
+        assert client.text_part(items["7"]["BODYSTRUCTURE"]) == ("1", "plain", "7bit", "utf-8")
+        client.logout()
+        server.shutdown()
+
+    def test_search(self) -> None:
+        """Test compound UID SEARCH on server side, with and without ESEARCH."""
+        pattern = re.compile(r"https://example\.com/verify/\w+")
+        timestamp = int(arrow.now().shift(days=-1).timestamp())
+        for capabilities in ((), ("ESEARCH",)):
+            server = self.new_server(capabilities)
+            server.add("Verify", "https://example.com/verify/other", to="other@example.com")
+            client = self.new_client(server)
+            query = client.build_query(
+                "noreply@example.com", "user@example.com", "Verify", timestamp
+            )
+            assert query.startswith("(SINCE ") and 'TO "user@example.com"' in query
+
+            server.commands.clear()
+            urls = client.lookup(query, pattern, timestamp, subject="Verify")
+            assert urls == ["https://example.com/verify/abc"]
+            assert server.commands[1].startswith("UID SEARCH ")
+            fetches = [x for x in server.commands if x.startswith("UID FETCH")]
+            assert fetches[0].startswith("UID FETCH 22 ")
+            if capabilities:
+                assert "RETURN (MIN MAX COUNT ALL)" in server.commands[1]
+                client.conn.select("Inbox")
+                stats = client.esearch('SUBJECT "newsletter"', ("MIN", "MAX", "COUNT"))
+                assert stats == {"MIN": 2, "MAX": 21, "COUNT": 20}
+                assert client.esearch('SUBJECT "nothing"') == {}
+            server.shutdown()
+
+    def test_sync(self) -> None:
+        """Test incremental sync by checkpoint of UIDVALIDITY and UIDNEXT."""
+        file = Path(__file__).parent / "imap_sync.json"
+        file.unlink(missing_ok=True)
+        pattern = re.compile(r"https://example\.com/verify/\w+")
+        server = self.new_server()
+        client = self.new_client(server)
+        client.checkpoint = MemoryCache(file)
+        timestamp = int(arrow.now().shift(days=-1).timestamp())
+        query = client.build_query("noreply@example.com", "", "Verify", timestamp)
+
+        assert client.lookup(query, pattern, subject="Verify") == [
+            "https://example.com/verify/abc"
+        ]
+        # nothing new, no search at all
+        server.commands.clear()
+        assert client.lookup(query, pattern, subject="Verify") == []
+        assert not any("SEARCH" in x for x in server.commands)
+
+        server.add("Verify again", "https://example.com/verify/new")
+        server.commands.clear()
+        assert client.lookup(query, pattern, subject="Verify") == [
+            "https://example.com/verify/new"
+        ]
+        assert server.commands[1].startswith("UID SEARCH UID 23:* ")
+        client.checkpoint.save()
+
+        # checkpoint reloaded, full search again once UIDVALIDITY changed
+        client.checkpoint = MemoryCache(file)
+        assert client.lookup(query, pattern, subject="Verify") == []
+        server.uid_validity += 1
+        assert sorted(client.lookup(query, pattern, subject="Verify")) == [
+            "https://example.com/verify/abc", "https://example.com/verify/new"
+        ]
+        client.logout()
+        server.shutdown()
+        file.unlink()
+
+    @staticmethod
+    def test_query() -> None:
+        """Test query quoting."""
+        client = ImapClient("127.0.0.1", 143, "usr", "pwd")
+        query = client.build_query(subject='say "hi"', to_email="中文@example.com")
+        assert query == '(SUBJECT "say \\"hi\\"")'
+        assert client.build_query() == "ALL"
+
+    def test_filter(self) -> None:
+        """Test capabilities after login, non-ascii sender filtered locally."""
+        pattern = re.compile(r"https://example\.com/verify/\w+")
+        for code in (False, True):
+            server = self.new_server()
+            server.login_capabilities = ["ESEARCH"]
+            server.capability_code = code
+            server.add("Verify", "https://example.com/verify/zh", sender="张三 <zs@example.com>")
+            client = self.new_client(server)
+            assert client.has_capability("ESEARCH")
+            assert any(x.startswith("CAPABILITY") for x in server.commands[2:]) is not code
+
+            urls = client.search("张三", "", "Verify", pattern, retry=1)
+            assert urls == ["https://example.com/verify/zh"]
+            urls = client.search("", "", "Verify", pattern, retry=1)
+            assert len(urls) == 3
+            client.logout()
+            server.shutdown()
+
+    def test_pool(self) -> None:
+        """Test reuse, reconnect and expiry of pooled clients."""
+        server = self.new_server()
+        port = server.server_address[1]
+        pool = ImapPool(keepalive=0)
+        pattern = re.compile(r"https://example\.com/verify/\w+")
+        for _ in range(3):
+            with pool.client("127.0.0.1", port, "user@example.com", "pwd", False) as client:
+                assert client.search("", "", "Verify", pattern, retry=1)
+        assert len(pool) == 1
+        assert len([x for x in server.commands if x.startswith("LOGIN")]) == 1
+
+        # dead connection replaced by new login
+        with pool.client("127.0.0.1", port, "user@example.com", "pwd", False) as client:
+            client.conn.shutdown()
+        with pool.client("127.0.0.1", port, "user@example.com", "pwd", False) as client:
+            assert client.is_alive()
+        assert len([x for x in server.commands if x.startswith("LOGIN")]) == 2
+        with pool.client("127.0.0.1", port, "other@example.com", "pwd", False):
+            assert len(pool) == 1
+        assert len(pool) == 2
+
+        # returned on IMAP error or error of caller, dropped on abort
+        for error in (imaplib.IMAP4.error, KeyError, imaplib.IMAP4.abort):
+            try:
+                with pool.client("127.0.0.1", port, "other@example.com", "pwd", False):
+                    assert len(pool) == 1
+                    raise error("failed")
+            except error:
+                pass
+        assert len(pool) == 1
+        assert len([x for x in server.commands if x.startswith("LOGOUT")]) == 1
+
+        pool.max_idle = 0
+        pool.ping()
+        assert len(pool) == 0
+        assert len([x for x in server.commands if x.startswith("LOGOUT")]) == 2
+        pool.close()
+        server.shutdown()
+
+    def test_idle(self) -> None:
+        """Test wait for new message pushed by IDLE, and many mailboxes."""
+        servers = [self.new_server(("IDLE",)) for _ in range(2)]
+        pattern = re.compile(r"https://example\.com/verify/\w+")
+        client = self.new_client(servers[0])
+        found: List[str] = []
+        start = time.time()
+
+        def deliver() -> None:
+            time.sleep(0.3)
+            servers[0].add("Verify again", "https://example.com/verify/new")
+
+        Thread(target=deliver).start()
+        found = client.wait_search("", "", "Verify again", pattern, timeout=5)
+        assert found == ["https://example.com/verify/new"]
+        assert time.time() - start < 2
+        assert any(x.startswith("IDLE") for x in servers[0].commands)
+
+        idler = ImapIdler()
+        clients = [self.new_client(server) for server in servers]
+        assert all(idler.add(x) for x in clients)
+        assert not idler.wait(0.2)
+        servers[1].add("Hello", "world")
+        assert idler.wait(5) == [clients[1]]
+        idler.close()
+        assert all(x.is_alive() for x in clients)
+
+        # connection dropped while idling, login and IDLE again
+        servers[0].drop_idle = 1
+        logins = len([x for x in servers[0].commands if x.startswith("LOGIN")])
+        start = time.time()
+        Thread(target=lambda: (time.sleep(0.5), servers[0].add("Verify 3", "verify/3"))).start()
+        client = self.new_client(servers[0])
+        found = client.wait_search("", "", "Verify 3", re.compile(r"verify/\d"), timeout=5)
+        assert found == ["verify/3"] and time.time() - start < 2
+        assert len([x for x in servers[0].commands if x.startswith("LOGIN")]) == logins + 2
+
+        servers[1].drop_idle = 1
+        idler = ImapIdler()
+        assert idler.add(clients[1])
+        start = time.time()
+        assert not idler.wait(5) and time.time() - start < 1
+        assert idler.dead == [clients[1]] and clients[1].conn is None
+        idler.close()
+        for server in servers:
+            server.shutdown()
+
+    @staticmethod
+    def test_msg_set() -> None:
+        """Test message set compression."""
+        assert ImapClient.msg_set(["5", "1", "2", "3", "8", "9", "11"]) == "1:3,5,8:9,11"
+        assert ImapClient.msg_set([]) == ""
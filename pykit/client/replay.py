@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Record/Replay Transport for Http, offline tests and benchmarks.
+
+Features:
+- Record request/response pairs through network into compact archive
+- Replay them without network, with artificial latency
+- Mounted as requests transport adapter, work for any Http user
+
+"""
+
+import gzip
+import http.server
+import socketserver
+from time import sleep
+from random import uniform
+from hashlib import sha1
+from pathlib import Path
+from threading import Lock, Thread
+from datetime import timedelta
+from dataclasses import asdict, dataclass
+from typing import Any, Iterator
+
+import orjson
+import requests
+from requests import PreparedRequest, Response
+from requests.structures import CaseInsensitiveDict
+
+from .stats import TimingAdapter
+
+
+__all__ = ("Record", "ReplayAdapter", "ReplayMissError")
+
+
+class ReplayMissError(requests.RequestException):
+    """Request not found in archive while replaying."""
+
+
+@dataclass(slots=True)
+class Record:
+    """Recorded request/response pair, content kept outside meta."""
+
+    key: str
+    url: str
+    code: int
+    reason: str
+    headers: dict
+    elapsed: float
+    content: bytes = b""
+
+
+class ReplayAdapter(TimingAdapter):
+    """Transport adapter to record responses or replay them from archive.
+
+    Archive is a gzip file of records, each one is a json meta line with
+    size of content, followed by raw content bytes. Connections are timed
+    as TimingAdapter does when recording.
+
+    Parameters:
+        - file: Path, archive file
+        - mode: str, "record" through network or "replay" from archive
+        - latency: float, seconds added to every replayed response
+        - jitter: float, random seconds up to it added on latency
+        - scale: float, fraction of recorded elapsed added on latency
+    """
+
+    RECORD = "record"
+    REPLAY = "replay"
+
+    def __init__(self,
+                 file: Path,
+                 mode: str = REPLAY,
+                 latency: float = 0.0,
+                 jitter: float = 0.0,
+                 scale: float = 0.0,
+                 **kwargs: Any,
+                 ) -> None:
+        """Init Replay Adapter, load archive for replay mode."""
+        assert mode in (self.RECORD, self.REPLAY)
+        super().__init__(**kwargs)
+        self.file = file
+        self.mode = mode
+        self.latency = latency
+        self.jitter = jitter
+        self.scale = scale
+
+        self._lock = Lock()
+        # responses of same request replayed in recorded order, last one repeated
+        self.records: dict[str, list[Record]] = {}
+        self.cursor: dict[str, int] = {}
+        if mode == self.REPLAY:
+            self.load()
+
+    @staticmethod
+    def key(request: PreparedRequest) -> str:
+        """Get record key of request by method, url and body digest."""
+        body = request.body or b""
+        if isinstance(body, str):
+            body = body.encode()
+        digest = sha1(body).hexdigest()[:16] if body else ""
+        return f"{request.method} {request.url} {digest}"
+
+    def load(self) -> int:
+        """Load records from archive, return number of records."""
+        count = 0
+        if not self.file.is_file():
+            return count
+        with gzip.open(self.file, "rb") as file:
+            for line in iter(file.readline, b""):
+                meta = orjson.loads(line)
+                meta["content"] = file.read(meta.pop("size"))
+                record = Record(**meta)
+                self.records.setdefault(record.key, []).append(record)
+                count += 1
+        return count
+
+    def iter_records(self) -> Iterator[Record]:
+        """All records in recorded order of keys."""
+        for records in self.records.values():
+            yield from records
+
+    def save(self) -> int:
+        """Save records into archive, return number of records."""
+        count = 0
+        with self._lock:
+            records = list(self.iter_records())
+        with gzip.open(self.file, "wb") as file:
+            for record in records:
+                meta = asdict(record)
+                content = meta.pop("content")
+                meta["size"] = len(content)
+                file.write(orjson.dumps(meta, option=orjson.OPT_APPEND_NEWLINE))
+                file.write(content)
+                count += 1
+        return count
+
+    def record(self, request: PreparedRequest, response: Response) -> None:
+        """Keep response of request, body read in full."""
+        record = Record(
+            key=self.key(request),
+            url=response.url,
+            code=response.status_code,
+            reason=response.reason or "",
+            headers=dict(response.headers),
+            elapsed=response.elapsed.total_seconds(),
+            content=response.content,
+        )
+        with self._lock:
+            self.records.setdefault(record.key, []).append(record)
+
+    def find(self, request: PreparedRequest) -> Record:
+        """Find next recorded response of request."""
+        key = self.key(request)
+        with self._lock:
+            records = self.records.get(key)
+            if not records:
+                raise ReplayMissError(f"not recorded: {key}", request=request)
+            index = self.cursor.get(key, 0)
+            self.cursor[key] = index + 1
+        return records[min(index, len(records) - 1)]
+
+    def delay(self, record: Record) -> float:
+        """Get artificial latency seconds of record."""
+        seconds = self.latency + self.scale * record.elapsed
+        if self.jitter:
+            seconds += uniform(0, self.jitter)
+        return seconds
+
+    def replay(self, request: PreparedRequest) -> Response:
+        """Build response of request from archive."""
+        record = self.find(request)
+        seconds = self.delay(record)
+        if seconds > 0:
+            sleep(seconds)
+
+        response = Response()
+        response.status_code = record.code
+        response.reason = record.reason
+        response.url = record.url
+        response.headers = CaseInsensitiveDict(record.headers)
+        response.encoding = requests.utils.get_encoding_from_headers(response.headers)
+        response.elapsed = timedelta(seconds=seconds)
+        response.request = request
+        response.connection = self
+        response._content = record.content  # pylint: disable=W0212
+        response._content_consumed = True  # pylint: disable=W0212
+        return response
+
+    def send(  # type: ignore  # pylint: disable=W0221
+        self, request: PreparedRequest, *args: Any, **kwargs: Any
+    ) -> Response:
+        """Send request through network and record, or replay from archive."""
+        if self.mode == self.REPLAY:
+            return self.replay(request)
+        response = super().send(request, *args, **kwargs)
+        self.record(request, response)
+        return response
+
+    def reset(self) -> None:
+        """Rewind replay cursors to the first recorded response."""
+        with self._lock:
+            self.cursor.clear()
+
+
+class TestReplayAdapter:
+    """TestCase for ReplayAdapter."""
+
+    file = Path(__file__).parent / "replay.gz"
+
+    class Server(socketserver.ThreadingTCPServer):
+        """Threading TCP server with daemon threads."""
+
+        daemon_threads = True
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        """Respond 503 for first request of path, then 200 with path echoed."""
+
+        seen: set[str] = set()
+
+        def do_GET(self) -> None:  # pylint: disable=C0103
+            """Response for GET."""
+            code = 200 if self.path in self.seen else 503
+            self.seen.add(self.path)
+            content = self.path.encode()
+            self.send_response(code)
+            self.send_header("Content-Length", str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+
+        def log_message(self, *args: object) -> None:
+            """Silent."""
+
+    def test_replay(self) -> None:
+        """Test record through network then replay offline."""
+        server = self.Server(("127.0.0.1", 0), self.Handler)
+        Thread(target=server.serve_forever, daemon=True).start()
+        url = f"http://127.0.0.1:{server.server_address[1]}/page"
+
+        adapter = ReplayAdapter(self.file, mode=ReplayAdapter.RECORD)
+        session = requests.Session()
+        session.mount("http://", adapter)
+        codes = [session.get(url, params={"q": "1"}).status_code for _ in range(2)]
+        assert codes == [503, 200]
+        assert adapter.save() == 2
+        server.shutdown()
+        server.server_close()
+
+        adapter = ReplayAdapter(self.file, latency=0.01)
+        session = requests.Session()
+        session.mount("http://", adapter)
+        responses = [session.get(url, params={"q": "1"}) for _ in range(3)]
+        assert [x.status_code for x in responses] == [503, 200, 200]
+        assert responses[-1].text == "/page?q=1"
+        assert responses[-1].elapsed.total_seconds() >= 0.01
+        try:
+            session.get(url)
+        except ReplayMissError:
+            pass
+        else:
+            raise AssertionError("replay miss not raised")
+        self.file.unlink()
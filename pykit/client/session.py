@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Session State Store for Http cookies and headers.
+
+Features:
+- Single SQLite file indexed by account key, instead of file per session
+- Lazy load of one account
+- Batched save in one transaction
+- Thread safe
+
+"""
+
+import sqlite3
+from time import time
+from pathlib import Path
+from threading import Lock
+from dataclasses import dataclass, field
+from typing import Iterable, Optional
+
+import orjson
+
+
+__all__ = ("SessionState", "SessionStore")
+
+
+@dataclass(slots=True)
+class SessionState:
+    """Cookies and headers of one session."""
+
+    cookies: dict = field(default_factory=dict)
+    headers: dict = field(default_factory=dict)
+    updated: int = 0
+
+
+class SessionStore:
+    """SQLite store of session states keyed by account.
+
+    Saved states are pending in memory until `batch` of them, then written
+    together in one transaction, call `flush` or `close` to write the rest.
+    """
+
+    schema = (
+        "CREATE TABLE IF NOT EXISTS session ("
+        "key TEXT PRIMARY KEY, cookies BLOB, headers BLOB, updated INTEGER"
+        ") WITHOUT ROWID"
+    )
+
+    def __init__(self, file: Path, batch: int = 100) -> None:
+        """Init Session Store, create database file if not exist."""
+        assert batch > 0
+        self.file = file
+        self.batch = batch
+
+        self._lock = Lock()
+        self._pending: dict[str, SessionState] = {}
+        self._conn = sqlite3.connect(file, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(self.schema)
+        self._conn.commit()
+
+    def get(self, key: str) -> Optional[SessionState]:
+        """Get session state of key, None if not found."""
+        with self._lock:
+            state = self._pending.get(key)
+            if state is not None:
+                return state
+            row = self._conn.execute(
+                "SELECT cookies, headers, updated FROM session WHERE key = ?",
+                (key,),
+            ).fetchone()
+        if row is None:
+            return None
+        return SessionState(
+            cookies=orjson.loads(row[0]),
+            headers=orjson.loads(row[1]),
+            updated=row[2],
+        )
+
+    def set(self, key: str, cookies: dict, headers: Optional[dict] = None) -> None:
+        """Save session state of key, written when batch is full."""
+        state = SessionState(
+            cookies=dict(cookies),
+            headers=dict(headers) if headers else {},
+            updated=int(time()),
+        )
+        with self._lock:
+            self._pending[key] = state
+            if len(self._pending) >= self.batch:
+                self._write()
+
+    def _write(self) -> None:
+        """Write pending states in one transaction, lock held by caller."""
+        if not self._pending:
+            return
+        rows = [
+            (key, orjson.dumps(x.cookies), orjson.dumps(x.headers), x.updated)
+            for key, x in self._pending.items()
+        ]
+        with self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO session VALUES (?, ?, ?, ?)", rows
+            )
+        self._pending.clear()
+
+    def flush(self) -> None:
+        """Write all pending states."""
+        with self._lock:
+            self._write()
+
+    def delete(self, keys: Iterable[str]) -> None:
+        """Delete session states of keys."""
+        keys = list(keys)
+        with self._lock:
+            for key in keys:
+                self._pending.pop(key, None)
+            with self._conn:
+                self._conn.executemany(
+                    "DELETE FROM session WHERE key = ?", [(key,) for key in keys]
+                )
+
+    def keys(self) -> list[str]:
+        """All keys saved, pending included."""
+        with self._lock:
+            self._write()
+            rows = self._conn.execute("SELECT key FROM session").fetchall()
+        return [row[0] for row in rows]
+
+    def __contains__(self, key: str) -> bool:
+        return self.get(key) is not None
+
+    def __len__(self) -> int:
+        with self._lock:
+            self._write()
+            return self._conn.execute("SELECT COUNT(*) FROM session").fetchone()[0]
+
+    def close(self) -> None:
+        """Write pending states and close database."""
+        with self._lock:
+            self._write()
+            self._conn.close()
+
+
+class TestSessionStore:
+    """TestCase for SessionStore."""
+
+    file = Path(__file__).parent / "session.db"
+
+    def clean(self) -> None:
+        """Remove database files."""
+        for suffix in ("", "-wal", "-shm"):
+            Path(f"{self.file}{suffix}").unlink(missing_ok=True)
+
+    def test_store(self) -> None:
+        """Test batched save, lazy load and delete."""
+        self.clean()
+        store = SessionStore(self.file, batch=3)
+        store.set("a1", {"sid": "1"}, {"User-Agent": "Mozilla"})
+        store.set("a2", {"sid": "2"})
+        # pending states readable before written
+        assert store.get("a1").cookies == {"sid": "1"}
+        assert not SessionStore(self.file).get("a1")
+
+        store.set("a3", {"sid": "3"})
+        other = SessionStore(self.file)
+        assert other.get("a2").cookies == {"sid": "2"}
+        assert other.get("a1").headers == {"User-Agent": "Mozilla"}
+        assert other.get("a4") is None
+
+        store.set("a1", {"sid": "4"})
+        store.delete(["a2"])
+        store.close()
+        assert sorted(other.keys()) == ["a1", "a3"]
+        assert other.get("a1").cookies == {"sid": "4"}
+        assert len(other) == 2 and "a3" in other
+        other.close()
+        self.clean()
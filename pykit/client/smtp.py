@@ -1,25 +1,47 @@
 """SMTP Mail Sender."""
 
 import smtplib
+import socket
+from string import Template
+from time import perf_counter, sleep
+from uuid import uuid4
 from pathlib import Path
-from typing import Union
+from queue import Empty, SimpleQueue
+from threading import Lock, Thread
+from typing import Any, Iterable, Iterator, Optional, Union
 
-from smtplib import SMTP, SMTP_SSL
+import regex as re
+from smtplib import SMTP, SMTP_SSL, quoteaddr
 from email.mime.text import MIMEText
 from email.mime.base import MIMEBase
 from email.mime.multipart import MIMEMultipart
-from email.utils import make_msgid
-from email import encoders
+from email.utils import formataddr, formatdate, make_msgid, parseaddr
+from email import encoders, message_from_bytes, policy
 
+from ..base.limiter import RateLimiter
 
-__all__ = ("MailSender",)
+
+__all__ = ("MailSender", "MailTemplate", "SmtpPool")
+
+
+# line ending not CRLF, and leading period of line to be doubled in DATA
+PATTERN_EOL = re.compile(rb"\r\n|\n|\r")
+PATTERN_PERIOD = re.compile(rb"(?m)^\.")
+# line break in header value or address, injects header or command
+PATTERN_NEWLINE = re.compile(r"[\r\n]+")
 
 
 class MailSender:
     """Sender email via SMTP."""
 
     def __init__(
-        self, host: str, port: int, usr: str, pwd: str, use_ssl: bool = False
+        self,
+        host: str,
+        port: int,
+        usr: str,
+        pwd: str,
+        use_ssl: bool = False,
+        use_tls: bool = True,
     ) -> None:
         """Init SMTP Mail Sender."""
         self.host = host
@@ -27,13 +49,10 @@ class MailSender:
         self.usr = usr
         self.pwd = pwd
         self.use_ssl = use_ssl
+        self.use_tls = use_tls  # STARTTLS if not ssl
 
         self.connected = False
-        self.smtpserver: Union[SMTP, SMTP_SSL]
-        if self.use_ssl:
-            self.smtpserver = smtplib.SMTP_SSL(self.host, self.port)
-        else:
-            self.smtpserver = smtplib.SMTP(self.host, self.port)
+        self.smtpserver: Any = None  # SMTP or SMTP_SSL, opened by connect
 
         self.html_ready = False
         self.msg: Union[MIMEMultipart, MIMEText]
@@ -121,17 +140,37 @@ class MailSender:
             )
             raise
 
+    def open(self) -> Union[SMTP, SMTP_SSL]:
+        """Open connection to SMTP server, not logged in yet."""
+        if self.use_ssl:
+            return smtplib.SMTP_SSL(self.host, self.port)
+        return smtplib.SMTP(self.host, self.port)
+
     def connect(self) -> None:
         """Connect to SMTP server using the username and password. Must be called before sending messages."""
-        if not self.use_ssl:
+        if self.smtpserver is None:
+            self.smtpserver = self.open()
+        if not self.use_ssl and self.use_tls:
             self.smtpserver.starttls()
 
-        self.smtpserver.login(self.usr, self.pwd)
+        if self.usr:
+            self.smtpserver.login(self.usr, self.pwd)
+        self.smtpserver.ehlo_or_helo_if_needed()
         self.connected = True
 
+    def reconnect(self) -> None:
+        """Open new connection and login again, old one dropped."""
+        try:
+            self.disconnect()
+        except OSError:
+            self.smtpserver = None
+        self.connect()
+
     def disconnect(self) -> None:
         """Disconnect from smtp server."""
-        self.smtpserver.close()
+        if self.smtpserver is not None:
+            self.smtpserver.close()
+            self.smtpserver = None
         self.connected = False
 
     def send(self, recipient: str = "") -> None:
@@ -168,4 +207,616 @@ class MailSender:
         #  print("All messages sent")
 
         self.disconnect()
-        #  print("Connection closed")
\ No newline at end of file
+        #  print("Connection closed")
+
+    def render(self, recipient: str) -> bytes:
+        """Render message to recipient as bytes with CRLF line endings."""
+        self.msg.replace_header("To", recipient)
+        return self.msg.as_bytes(policy=self.msg.policy.clone(linesep="\r\n"))
+
+    @staticmethod
+    def quote_data(data: bytes) -> bytes:
+        """Quote message for DATA, CRLF line endings and periods doubled."""
+        data = PATTERN_PERIOD.sub(b"..", PATTERN_EOL.sub(b"\r\n", data))
+        if not data.endswith(b"\r\n"):
+            data += b"\r\n"
+        return data + b".\r\n"
+
+    def reply(self) -> tuple[int, str]:
+        """Read one reply of server."""
+        code, message = self.smtpserver.getreply()
+        return code, message.decode(errors="replace")
+
+    def send_template(
+        self,
+        template: "MailTemplate",
+        recipients: Iterable[Union[str, tuple[str, dict]]],
+        retry: int = 1,
+    ) -> dict[str, tuple[int, str]]:
+        """Send template rendered for each recipient, see `send_raw_many`."""
+        return self.send_raw_many(template.sender_email, template.render_many(recipients), retry)
+
+    def send_bulk(self, recipients: Iterable[str], retry: int = 1) -> dict[str, tuple[int, str]]:
+        """Send message to every recipient over one connection kept open.
+
+        See `send_raw_many` for pipelining, reconnect and results.
+        """
+        sender = parseaddr(self.msg["From"])[1]
+        return self.send_raw_many(sender, ((x, self.render(x)) for x in recipients), retry)
+
+    def send_raw_many(
+        self, sender: str, items: Iterable[tuple[str, bytes]], retry: int = 1
+    ) -> dict[str, tuple[int, str]]:
+        """Send rendered message to each recipient, connection kept open.
+
+        With PIPELINING of server, commands of next message are sent along
+        with content of previous one, one round trip per message. On
+        connection failure, reconnect and send unfinished ones again up to
+        retry times, message without final reply may then be sent twice.
+        Duplicate recipient is sent once, its first item only. Non-ascii
+        address is sent with SMTPUTF8 if server offers it, refused by 553
+        otherwise.
+
+        Returns:
+            (code, message) of final reply for each recipient, such as 250
+            if accepted, code of refused command otherwise, -1 if failed
+            by connection.
+        """
+        results: dict[str, tuple[int, str]] = {}
+        todo = []
+        seen = set()
+        for recipient, data in items:
+            # results keyed by recipient, retry skips ones with result
+            if recipient in seen:
+                continue
+            seen.add(recipient)
+            # line break in address would inject SMTP command
+            if PATTERN_NEWLINE.search(recipient) or PATTERN_NEWLINE.search(sender):
+                results[recipient] = (501, "line break in address")
+            else:
+                todo.append((recipient, data))
+        for attempt in range(retry + 1):
+            try:
+                if not self.connected:
+                    self.reconnect()
+                if not self.smtpserver.has_extn("smtputf8"):
+                    for recipient, _ in todo:
+                        if not (recipient.isascii() and sender.isascii()):
+                            results[recipient] = (553, "non-ascii address without SMTPUTF8")
+                    todo = [x for x in todo if x[0] not in results]
+                if self.smtpserver.has_extn("pipelining"):
+                    self._send_pipelined(sender, todo, results)
+                else:
+                    self._send_serial(sender, todo, results)
+                return results
+            except (smtplib.SMTPServerDisconnected, OSError) as err:
+                self.connected = False
+                todo = [x for x in todo if x[0] not in results]
+                if attempt == retry:
+                    for recipient, _ in todo:
+                        results[recipient] = (-1, repr(err))
+        return results
+
+    def _send_pipelined(
+        self, sender: str, items: list[tuple[str, bytes]], results: dict[str, tuple[int, str]]
+    ) -> None:
+        """Send messages with commands pipelined.
+
+        Content of message is sent in one write with commands of the next
+        one, the final reply of it read before replies of those commands.
+        """
+        server = self.smtpserver
+        content = b""  # content of previous message not sent yet
+        pending = ""  # recipient of the content
+        reset = False  # previous transaction refused, RSET first
+        for recipient, data in items:
+            option = "" if recipient.isascii() and sender.isascii() else " SMTPUTF8"
+            group = f"MAIL FROM:{quoteaddr(sender)}{option}\r\n"
+            group += f"RCPT TO:{quoteaddr(recipient)}\r\nDATA\r\n"
+            server.send(content + (b"RSET\r\n" if reset else b"") + group.encode())
+            content = b""
+            if pending:
+                results[pending] = self.reply()
+                pending = ""
+            if reset:
+                self.reply()
+            mail, rcpt, start = self.reply(), self.reply(), self.reply()
+            reset = start[0] != 354
+            if not reset:
+                content, pending = self.quote_data(data), recipient
+            elif mail[0] != 250:
+                results[recipient] = mail
+            elif rcpt[0] not in (250, 251):
+                results[recipient] = rcpt
+            else:
+                results[recipient] = start
+        if pending:
+            server.send(content)
+            results[pending] = self.reply()
+        if reset:
+            server.rset()
+
+    def _send_serial(
+        self, sender: str, items: list[tuple[str, bytes]], results: dict[str, tuple[int, str]]
+    ) -> None:
+        """Send messages one command at a time."""
+        server = self.smtpserver
+        for recipient, data in items:
+            options = [] if recipient.isascii() and sender.isascii() else ["SMTPUTF8"]
+            code, message = server.mail(sender, options)
+            if code == 250:
+                code, message = server.rcpt(recipient)
+            if code in (250, 251):
+                try:
+                    code, message = server.data(data)
+                except smtplib.SMTPDataError as err:
+                    code, message = err.smtp_code, err.smtp_error
+            if code != 250:
+                server.rset()
+            results[recipient] = (code, message.decode(errors="replace"))
+
+
+class MailTemplate:
+    """MIME message built once, rendered for each recipient cheaply.
+
+    Attachments and body are encoded and serialized once, only headers are
+    rendered for each recipient, body too if text has fields. Fields such
+    as `$name` or `${name}` are substituted by `string.Template`, missing
+    ones kept as is, `$email` is the recipient.
+    """
+
+    policy = policy.SMTP
+
+    def __init__(
+        self,
+        subject: str,
+        sender_email: str,
+        sender_name: str,
+        plain_text: str,
+        html_text: str = "",
+        list_attachment: Iterable[Path] = (),
+        headers: Optional[dict[str, str]] = None,
+        domain: str = "localhost",
+    ) -> None:
+        """Init MIME Template, attachments read and encoded."""
+        self.sender_email = sender_email
+        self.sender = formataddr((sender_name, sender_email))
+        self.subject = Template(subject)
+        self.headers = {key: Template(value) for key, value in (headers or {}).items()}
+        self.plain = Template(plain_text)
+        self.html = Template(html_text) if html_text else None
+        self.domain = domain
+
+        self.dynamic = any(x and x.get_identifiers() for x in (self.plain, self.html))
+        self.boundary = f"=============={uuid4().hex}=="
+        self.attachments = [self.encode_attachment(x) for x in list_attachment]
+        self.head, self.body = self.build_body({})
+
+    @staticmethod
+    def encode_attachment(file: Path) -> bytes:
+        """Encode file as base64 MIME part, serialized with headers."""
+        part = MIMEBase("application", "octet-stream")
+        part.set_payload(file.read_bytes())
+        encoders.encode_base64(part)
+        part.add_header("Content-Disposition", "attachment", filename=file.name)
+        del part["MIME-Version"]
+        return part.as_bytes(policy=part.policy.clone(linesep="\r\n"))
+
+    def text_part(self, fields: dict) -> Union[MIMEMultipart, MIMEText]:
+        """Build text part, plain and html alternatives if html."""
+        part: Union[MIMEMultipart, MIMEText]
+        plain = MIMEText(self.plain.safe_substitute(fields), "plain", "utf-8")
+        if not self.html:
+            part = plain
+        else:
+            part = MIMEMultipart("alternative")
+            part.attach(plain)
+            part.attach(MIMEText(self.html.safe_substitute(fields), "html", "utf-8"))
+        del part["MIME-Version"]
+        return part
+
+    def build_body(self, fields: dict) -> tuple[bytes, bytes]:
+        """Build content headers and body, mixed with attachments if any."""
+        part = self.text_part(fields)
+        data = part.as_bytes(policy=part.policy.clone(linesep="\r\n"))
+        if not self.attachments:
+            head, _, body = data.partition(b"\r\n\r\n")
+            return head + b"\r\n", body
+        boundary = self.boundary.encode()
+        body = b"".join(b"--" + boundary + b"\r\n" + x + b"\r\n" for x in (data, *self.attachments))
+        head = f'Content-Type: multipart/mixed; boundary="{self.boundary}"\r\n'.encode()
+        return head, body + b"--" + boundary + b"--\r\n"
+
+    def render(self, recipient: str, fields: Optional[dict] = None) -> bytes:
+        """Render message bytes for recipient with its fields.
+
+        Line breaks in header values are replaced by space, so untrusted
+        fields can not add headers, ValueError if recipient has any.
+        """
+        if PATTERN_NEWLINE.search(recipient):
+            raise ValueError(f"line break in recipient: {recipient!r}")
+        fields = {"email": recipient, **(fields or {})}
+        head, body = self.build_body(fields) if self.dynamic else (self.head, self.body)
+        headers = [
+            ("From", self.sender),
+            ("To", recipient),
+            ("Subject", self.subject.safe_substitute(fields)),
+            ("Date", formatdate(localtime=True)),
+            ("Message-ID", make_msgid(domain=self.domain)),
+            *[(key, value.safe_substitute(fields)) for key, value in self.headers.items()],
+            ("MIME-Version", "1.0"),
+        ]
+        lines = [
+            self.policy.header_factory(key, PATTERN_NEWLINE.sub(" ", value))
+            .fold(policy=self.policy).encode("ascii")
+            for key, value in headers
+        ]
+        return b"".join(lines) + head + b"\r\n" + body
+
+    def render_many(
+        self, recipients: Iterable[Union[str, tuple[str, dict]]]
+    ) -> Iterator[tuple[str, bytes]]:
+        """Render for each recipient, given as email or (email, fields).
+
+        ValueError raised as `render` for recipient with line break.
+        """
+        for item in recipients:
+            recipient, fields = (item, None) if isinstance(item, str) else item
+            yield recipient, self.render(recipient, fields)
+
+
+class SmtpPool:
+    """Pool of logged in SMTP connections, a queue of messages sent by threads.
+
+    Each worker thread owns one MailSender, connections kept open between
+    `send` calls until `close`. Messages are taken from queue by batch and
+    pipelined if server supports, recipients refused by transient 4xx
+    reply are queued again after backoff.
+
+    Parameters:
+        - host, port, usr, pwd, use_ssl, use_tls: of MailSender
+        - size: int, number of connections and threads
+        - limiter: RateLimiter keyed by host, may be shared by pools
+        - batch: int, messages taken from queue at once by a worker
+        - retry: int, max resend of transient 4xx failure
+        - backoff: float, seconds before first resend, doubled each time
+    """
+
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        usr: str,
+        pwd: str,
+        use_ssl: bool = False,
+        use_tls: bool = True,
+        size: int = 4,
+        limiter: Optional[RateLimiter] = None,
+        batch: int = 10,
+        retry: int = 2,
+        backoff: float = 1.0,
+    ) -> None:
+        """Init SMTP Pool, no connection opened yet."""
+        assert size > 0 and batch > 0
+        self.host = host
+        self.size = size
+        self.limiter = limiter
+        self.batch = batch
+        self.retry = retry
+        self.backoff = backoff
+        self.senders = [
+            MailSender(host, port, usr, pwd, use_ssl, use_tls) for _ in range(size)
+        ]
+        self._lock = Lock()
+        self._sending = Lock()
+
+    def send(self, sender: str, items: Iterable[tuple[str, bytes]]) -> dict[str, tuple[int, str]]:
+        """Send rendered message to each recipient, block until all done.
+
+        Calls from many threads are serialized, connections of pool are
+        driven by its own workers only.
+
+        Returns (code, message) of final reply for each recipient, see
+        `MailSender.send_raw_many`.
+        """
+        with self._sending:
+            return self._send(sender, items)
+
+    def _send(self, sender: str, items: Iterable[tuple[str, bytes]]) -> dict[str, tuple[int, str]]:
+        """Send by workers, lock held by caller."""
+        queue: SimpleQueue = SimpleQueue()
+        seen = set()
+        for recipient, data in items:
+            # duplicate sent once like `MailSender.send_raw_many`
+            if recipient not in seen:
+                seen.add(recipient)
+                queue.put((recipient, data, 0))
+        results: dict[str, tuple[int, str]] = {}
+        threads = [
+            Thread(target=self._work, args=(mailer, sender, queue, results), daemon=True)
+            for mailer in self.senders
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def _take(self, queue: SimpleQueue) -> list[tuple[str, bytes, int]]:
+        """Take up to batch items from queue, rate limited by host."""
+        items = []
+        while len(items) < self.batch:
+            try:
+                items.append(queue.get_nowait())
+            except Empty:
+                break
+        if items and self.limiter:
+            self.limiter.bucket(self.host).acquire(len(items))
+        return items
+
+    def _work(
+        self,
+        mailer: MailSender,
+        sender: str,
+        queue: SimpleQueue,
+        results: dict[str, tuple[int, str]],
+    ) -> None:
+        """Send batches of queue until empty, resend transient failures."""
+        while True:
+            items = self._take(queue)
+            if not items:
+                return
+            try:
+                replies = mailer.send_raw_many(sender, [x[:2] for x in items])
+            except Exception as err:  # pylint: disable=W0703
+                # such as login refused or bad item, reported for the whole
+                # batch, connection dropped as transaction may be left open
+                mailer.disconnect()
+                replies = {x[0]: (-1, repr(err)) for x in items}
+            delay = 0.0
+            retries = []
+            for recipient, data, attempt in items:
+                code, message = replies.get(recipient, (-1, "not sent"))
+                if 400 <= code < 500 and attempt < self.retry:
+                    delay = max(delay, self.backoff * 2 ** attempt)
+                    retries.append((recipient, data, attempt + 1))
+                    continue
+                with self._lock:
+                    results[recipient] = (code, message)
+            # queued after backoff, not taken at once by other workers
+            if retries:
+                sleep(delay)
+                for item in retries:
+                    queue.put(item)
+
+    def close(self) -> None:
+        """Disconnect all connections."""
+        for mailer in self.senders:
+            try:
+                mailer.disconnect()
+            except OSError:
+                pass
+
+
+class TestMailSender:
+    """TestCase for MailSender with local aiosmtpd stand-in server."""
+
+    class Handler:
+        """Keep accepted messages, refuse `bad` recipients, drop connection once."""
+
+        def __init__(self, pipelining: bool = True, drop: int = 0) -> None:
+            self.pipelining = pipelining
+            self.drop = drop  # drop connection at this message, 0 never
+            self.count = 0
+            self.messages: list = []
+            self.sessions = 0
+            self.busy: set[str] = set()  # `busy` recipients deferred once
+            self.times: dict[str, list[float]] = {}  # time of each RCPT
+
+        async def handle_EHLO(self, server, session, envelope, hostname, responses):  # type: ignore  # pylint: disable=C0103
+            """Announce PIPELINING."""
+            self.sessions += 1
+            session.host_name = hostname
+            if self.pipelining:
+                responses.insert(-1, "250-PIPELINING")
+            return responses
+
+        async def handle_RCPT(self, server, session, envelope, address, options):  # type: ignore  # pylint: disable=C0103
+            """Refuse bad recipient, defer busy recipient once."""
+            self.times.setdefault(address, []).append(perf_counter())
+            if address.startswith("bad"):
+                return "550 5.1.1 No such user"
+            if address.startswith("busy") and address not in self.busy:
+                self.busy.add(address)
+                return "451 4.7.1 Try again later"
+            envelope.rcpt_tos.append(address)
+            return "250 OK"
+
+        async def handle_DATA(self, server, session, envelope):  # type: ignore  # pylint: disable=C0103
+            """Accept message, or drop connection once before reply."""
+            self.count += 1
+            if self.count == self.drop:
+                server.transport.close()
+                return "421 closing"
+            self.messages.append((envelope.rcpt_tos[0], envelope.content))
+            return "250 Message accepted"
+
+    @staticmethod
+    def new_controller(
+        handler: "TestMailSender.Handler", utf8: bool = False
+    ) -> tuple[Any, int]:
+        """Start aiosmtpd stand-in on free port, return controller and port."""
+        from aiosmtpd.controller import Controller  # pylint: disable=C0415
+
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            port = sock.getsockname()[1]
+        controller = Controller(
+            handler, hostname="127.0.0.1", port=port, enable_SMTPUTF8=utf8
+        )
+        controller.start()
+        return controller, port
+
+    @staticmethod
+    def new_sender(port: int) -> "MailSender":
+        """Connect MailSender without TLS and login."""
+        sender = MailSender("127.0.0.1", port, "", "", use_tls=False)
+        sender.set_message("hello\n.dot line", "", "Hi", "from@example.com", "Sender", "", [], "t")
+        sender.connect()
+        return sender
+
+    def test_bulk(self) -> None:
+        """Test pipelined and serial bulk send, refused recipient and reconnect."""
+        for pipelining in (True, False):
+            handler = self.Handler(pipelining, drop=4)
+            controller, port = self.new_controller(handler)
+            sender = self.new_sender(port)
+            assert sender.smtpserver.has_extn("pipelining") is pipelining
+
+            recipients = [f"user{x}@example.com" for x in range(6)] + ["bad@example.com"]
+            results = sender.send_bulk(recipients + recipients[:1])
+            assert len(results) == 7 and results["bad@example.com"][0] == 550
+            assert all(results[x][0] == 250 for x in recipients[:-1])
+            assert sorted(x[0] for x in handler.messages) == sorted(recipients[:-1])
+            assert b"\r\n..dot line" not in handler.messages[0][1]
+            assert b"\r\n.dot line" in handler.messages[0][1]
+            sender.disconnect()
+            controller.stop()
+
+    def test_utf8(self) -> None:
+        """Test non-ascii address sent by SMTPUTF8 if offered, refused otherwise."""
+        recipients = ["a@example.com", "zoë@example.com", "b@example.com"]
+        items = [(x, b"Subject: hi\r\n\r\nhello\r\n") for x in recipients]
+        for pipelining in (True, False):
+            for utf8 in (False, True):
+                handler = self.Handler(pipelining)
+                controller, port = self.new_controller(handler, utf8)
+                sender = self.new_sender(port)
+                results = sender.send_raw_many("from@example.com", items)
+                assert results["a@example.com"][0] == results["b@example.com"][0] == 250
+                assert results["zoë@example.com"][0] == (250 if utf8 else 553)
+                assert ("zoë@example.com" in [x[0] for x in handler.messages]) is utf8
+                sender.disconnect()
+                controller.stop()
+
+    def test_round_trips(self) -> None:
+        """Test round trips of bulk send, one per message if pipelined."""
+        handler = self.Handler()
+        controller, port = self.new_controller(handler)
+        recipients = [f"user{x}@example.com" for x in range(40)]
+        sender = self.new_sender(port)
+        writes = []
+        send = sender.smtpserver.send
+        sender.smtpserver.send = lambda data: (writes.append(data), send(data))
+        for pipelining in (False, True):
+            if not pipelining:
+                sender.smtpserver.esmtp_features.pop("pipelining")
+            else:
+                sender.smtpserver.esmtp_features["pipelining"] = ""
+            writes.clear()
+            results = sender.send_bulk(recipients)
+            assert all(x[0] == 250 for x in results.values())
+            # each write waits replies: MAIL, RCPT, DATA, content if serial
+            assert len(writes) == (41 if pipelining else 160)
+        sender.disconnect()
+        assert len(handler.messages) == 80 and handler.sessions == 1
+        controller.stop()
+
+    def test_pool(self) -> None:
+        """Test queue sent by pool within rate limit, transient failure resent."""
+        handler = self.Handler()
+        controller, port = self.new_controller(handler)
+        limiter = RateLimiter(rate=100, capacity=5)
+        pool = SmtpPool(
+            "127.0.0.1", port, "", "", use_tls=False, size=3, limiter=limiter, batch=5, backoff=0.2
+        )
+        assert all(x.smtpserver is None for x in pool.senders)
+
+        mailer = MailSender("127.0.0.1", port, "", "")
+        mailer.set_message("hello", "", "Hi", "from@example.com", "Sender", "", [], "t")
+        recipients = [f"user{x}@example.com" for x in range(40)]
+        recipients += ["busy@example.com", "bad@example.com"]
+        start = perf_counter()
+        results = pool.send("from@example.com", [(x, mailer.render(x)) for x in recipients])
+        # 42 messages and 1 resent, burst of 5 then 100/s
+        assert perf_counter() - start >= 38 / 100
+        assert results["busy@example.com"][0] == 250
+        first, second = handler.times["busy@example.com"]
+        assert second - first >= 0.2
+        assert results["bad@example.com"][0] == 550
+        assert sum(x[0] == 250 for x in results.values()) == 41
+        assert len(handler.messages) == 41 and handler.sessions == 3
+
+        results = pool.send("from@example.com", [(x, mailer.render(x)) for x in recipients[:6]])
+        assert len(results) == 6 and handler.sessions == 3
+
+        # unexpected error fails its batch only, worker keeps going
+        items = [(x, mailer.render(x)) for x in recipients[:20]]
+        items.insert(3, ("broken@example.com", None))  # type: ignore
+        results = pool.send("from@example.com", items)
+        assert len(results) == 21 and results["broken@example.com"][0] == -1
+        assert sum(x[0] == 250 for x in results.values()) >= 15
+        pool.close()
+        controller.stop()
+
+    def test_template(self) -> None:
+        """Test template rendered with fields and sent, attachment encoded once."""
+        file = Path(__file__).parent / "attachment.bin"
+        file.write_bytes(bytes(range(256)) * 40)
+        template = MailTemplate(
+            "Hi $name",
+            "from@example.com",
+            "Sender",
+            "Hello $name,\n.your code is ${code}.",
+            "<p style='a{b:c}'>Hello $name</p>",
+            [file],
+            headers={"X-Campaign": "spring"},
+        )
+        file.unlink()
+        attachment = template.attachments[0]
+
+        data = template.render("user@example.com", {"name": "Zoë", "code": "42"})
+        msg = message_from_bytes(data, policy=policy.default)
+        assert msg["Subject"] == "Hi Zoë" and msg["To"] == "user@example.com"
+        assert msg["X-Campaign"] == "spring" and msg.get_content_type() == "multipart/mixed"
+        assert msg.get_body(("plain",)).get_content() == "Hello Zoë,\n.your code is 42."
+        assert "a{b:c}" in msg.get_body(("html",)).get_content()
+        part = next(msg.iter_attachments())
+        assert part.get_filename() == "attachment.bin"
+        assert part.get_content() == bytes(range(256)) * 40
+        assert attachment in template.render("other@example.com", {"name": "Bob"})
+
+        # fields can not inject header, recipient can not either
+        data = template.render("u@example.com", {"name": "Bob\r\nBcc: victim@x.com"})
+        msg = message_from_bytes(data, policy=policy.default)
+        assert msg["Bcc"] is None and msg["Subject"] == "Hi Bob Bcc: victim@x.com"
+        try:
+            template.render("u@example.com\r\nBcc: victim@x.com")
+        except ValueError:
+            pass
+        else:
+            raise AssertionError("line break in recipient not refused")
+        quoted = MailTemplate("Hi", "from@example.com", "Doe, John", "Hello")
+        msg = message_from_bytes(quoted.render("a@example.com"), policy=policy.default)
+        assert len(msg["From"].addresses) == 1
+        assert msg["From"].addresses[0].display_name == "Doe, John"
+
+        # static body reused as is
+        static = MailTemplate("Hi", "from@example.com", "Sender", "Hello")
+        assert not static.dynamic and static.render("a@example.com").endswith(static.body)
+
+        handler = self.Handler()
+        controller, port = self.new_controller(handler)
+        sender = MailSender("127.0.0.1", port, "", "", use_tls=False)
+        sender.connect()
+        recipients = [(f"user{x}@example.com", {"name": f"user{x}"}) for x in range(5)]
+        results = sender.send_template(template, recipients + ["bad@example.com"])
+        assert results.pop("bad@example.com")[0] == 550
+        assert sender.send_raw_many("f@example.com", [("a@e.com>\r\nRSET", b"x")]) == {
+            "a@e.com>\r\nRSET": (501, "line break in address")
+        }
+        assert [x[0] for x in results.values()] == [250] * 5
+        content = dict(handler.messages)["user3@example.com"]
+        assert b"Subject: Hi user3" in content
+        sender.disconnect()
+        controller.stop()
@@ -4,13 +4,18 @@
 """Browser for Scraper, etc. HTTP Tasks."""
 
 from random import choice
+from typing import Optional
 
-from requests import RequestException
+import orjson
+from requests import Response
 
 from ..base.io import IO
 from ..base.log import init_logger
 from ..base.debug import Debugger
-from ..base.http import Http
+from ..base.proxy import ProxyPool
+from ..client.http import Http
+from ..client.replay import ReplayAdapter
+from ..client.retry import Attempt, RetryPolicy, report_attempts
 
 from ..config import Config
 from .common import Utils
@@ -25,18 +30,26 @@ class Browser:
     logger = init_logger(name="browser")
     debugger = Debugger(path=config.dir_debug, name="browser")
 
+    timeout = 30
+    policy = RetryPolicy()
+    replay: Optional[ReplayAdapter] = None  # record/replay transport for offline run
+
     def __init__(self) -> None:
         """Init Browser."""
         self.list_ua = self.load_user_agent()
         self.list_px = self.load_proxy()
         assert self.list_ua
         assert self.list_px
+        self.pool = ProxyPool.from_urls(
+            self.list_px, file=self.config.dir_cache / "proxy_pool.json"
+        )
 
         # set client default, you may use random ones later.
         self.client: Http = self.new_client(
             user_agent=self.list_ua[0],
-            proxy_url=self.list_px[0],
+            proxy_url=self.pool.choose().url if self.pool else self.list_px[0],
         )
+        self.attempts: list[Attempt] = []  # attempts of last get_retry
 
     def load_user_agent(self) -> list[str]:
         """Load list of User-Ageng string."""
@@ -59,38 +72,42 @@ class Browser:
             proxy_url=proxy_url,
             logger=self.logger,
             debugger=self.debugger,
-            time_out=self.timeout,
+            timeout=self.timeout,
+            replay=self.replay,
         )
 
     def rnd_client(self) -> Http:
-        """Generate Random Http Client."""
+        """Generate Random Http Client, proxy chosen from pool weighted by health."""
+        proxy_url = self.pool.choose().url if self.pool else choice(self.list_px)
         return self.new_client(
             user_agent=choice(self.list_ua),
-            proxy_url=choice(self.list_px),
+            proxy_url=proxy_url,
+        )
+
+    def get_retry(
+        self, url: str, debug: bool = False, retry: int = 0
+    ) -> Optional[Response]:
+        """HTTP GET with RetryPolicy, timing of attempts saved into self.attempts."""
+        result = self.policy.send(
+            self.client, self.rnd_client, "GET", url, total=retry, debug=debug
         )
+        self.client = result.http
+        self.attempts = result.attempts
+        report_attempts(self.pool, result.attempts)
+        return result.response
 
     def http_get_html(self, url: str, debug: bool = False, retry: int = 3) -> str:
         """HTTP GET Method to get html string from url."""
-        for _ in range(retry):
-            try:
-                with self.client.get(url=url, debug=debug) as response:
-                    if response:
-                        return response.text
-            except RequestException as err:
-                if debug:
-                    raise err
-            self.utils.smart_delay(2)
-        return ""
+        response = self.get_retry(url=url, debug=debug, retry=retry)
+        return response.text if response else ""
 
     def http_get_json(self, url: str, debug: bool = False, retry: int = 3) -> dict:
-        """HTTP GET Method to get json dict from url."""
-        for _ in range(retry):
+        """HTTP GET Method to get json dict from url, body bytes decoded by orjson."""
+        response = self.get_retry(url=url, debug=debug, retry=retry)
+        if response:
             try:
-                with self.client.get(url=url, debug=debug) as response:
-                    if response:
-                        return response.json()
-            except RequestException as err:
+                return orjson.loads(response.content)
+            except orjson.JSONDecodeError as err:
                 if debug:
                     raise err
-            self.utils.smart_delay(2)
         return {}
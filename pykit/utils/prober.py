@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Parallel Proxy Liveness Prober for HTTP/SOCKS4/SOCKS5 Proxy."""
+
+import socket
+import select
+import socketserver
+import http.server
+from time import time
+from pathlib import Path
+from threading import Thread
+from dataclasses import dataclass
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Iterable, Iterator, Optional
+
+import socks
+
+from ..base.io import IO
+from ..base.log import Logger
+from ..base.proxy import Proxy
+
+
+__all__ = ("ProbeResult", "ProxyProber")
+
+
+@dataclass
+class ProbeResult:
+    """Result of proxy probing."""
+
+    url: str
+    alive: bool = False
+    latency: float = 0.0  # seconds to connect through proxy and get response
+    error: str = ""
+
+
+class ProxyProber:
+    """Check proxies connectivity and latency concurrently.
+
+    Parameters:
+        - host: str, target host to connect through proxy
+        - port: int, target port, plain HTTP expected
+        - timeout: float, seconds for connect and read
+        - concurrency: int, number of proxies probing at the same time
+    """
+
+    def __init__(self,
+                 host: str = "www.google.com",
+                 port: int = 80,
+                 timeout: float = 10.0,
+                 concurrency: int = 200,
+                 logger: Optional[Logger] = None,
+                 ) -> None:
+        """Init Proxy Prober."""
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.concurrency = concurrency
+        self.logger = logger
+
+    @staticmethod
+    def parse(lines: Iterable[str]) -> list[Proxy]:
+        """Parse proxy lines into deduplicated list of Proxy, skip bad ones."""
+        return Proxy.load_many(lines)
+
+    def probe(self, proxy: Proxy) -> ProbeResult:
+        """Connect target through proxy and wait for HTTP response."""
+        result = ProbeResult(url=proxy.url)
+        start = time()
+        try:
+            with socks.create_connection(
+                (self.host, self.port),
+                timeout=self.timeout,
+                proxy_type=proxy.type,
+                proxy_addr=proxy.addr,
+                proxy_port=proxy.port,
+                proxy_rdns=proxy.rdns,
+                proxy_username=proxy.usr or None,
+                proxy_password=proxy.pwd or None,
+            ) as sock:
+                request = (
+                    f"HEAD / HTTP/1.1\r\nHost: {self.host}\r\n"
+                    "Connection: close\r\n\r\n"
+                )
+                sock.sendall(request.encode())
+                head = sock.recv(16)
+                if head.startswith(b"HTTP/"):
+                    result.alive = True
+                    result.latency = time() - start
+                else:
+                    result.error = f"bad response: {head!r}"
+        except (OSError, socks.ProxyError) as err:
+            result.error = repr(err)
+        if self.logger:
+            self.logger.debug(
+                "[%s]<%.3f>%s %s",
+                result.alive, result.latency, result.url, result.error,
+            )
+        return result
+
+    def probe_many(self, proxies: Iterable[Proxy]) -> Iterator[ProbeResult]:
+        """Probe proxies concurrently, yield result as soon as each completed."""
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            futures = [pool.submit(self.probe, proxy) for proxy in proxies]
+            for future in as_completed(futures):
+                yield future.result()
+
+    @staticmethod
+    def rank(results: Iterable[ProbeResult]) -> list[ProbeResult]:
+        """Alive results sorted by latency, fastest first."""
+        return sorted(
+            (result for result in results if result.alive),
+            key=lambda x: x.latency,
+        )
+
+    def run(self, file_in: Path, file_out: Path) -> list[ProbeResult]:
+        """Probe proxy lines from file_in, save ranked alive proxy urls into file_out."""
+        proxies = self.parse(IO.load_line(file_in))
+        ranked = self.rank(self.probe_many(proxies))
+        IO.save_line(file_out, [result.url for result in ranked])
+        return ranked
+
+
+class TestProxyProber:
+    """TestCase for ProxyProber with local HTTP CONNECT proxy stand-in."""
+
+    class Server(socketserver.ThreadingTCPServer):
+        """Threading TCP server with daemon threads."""
+
+        daemon_threads = True
+
+    class ConnectProxy(socketserver.BaseRequestHandler):
+        """Minimal HTTP CONNECT proxy."""
+
+        def handle(self) -> None:
+            """Tunnel client to target."""
+            head = b""
+            while b"\r\n\r\n" not in head:
+                chunk = self.request.recv(1024)
+                if not chunk:
+                    return
+                head += chunk
+            host, port = head.split()[1].decode().split(":")
+            with socket.create_connection((host, int(port))) as target:
+                self.request.sendall(b"HTTP/1.1 200 Connection established\r\n\r\n")
+                socks_ = [self.request, target]
+                while True:
+                    readable, _, _ = select.select(socks_, [], [], 5)
+                    if not readable:
+                        return
+                    for sock in readable:
+                        data = sock.recv(4096)
+                        if not data:
+                            return
+                        other = target if sock is self.request else self.request
+                        other.sendall(data)
+
+    class Target(http.server.BaseHTTPRequestHandler):
+        """Target HTTP server."""
+
+        def do_HEAD(self) -> None:  # pylint: disable=C0103
+            """Response for HEAD."""
+            self.send_response(200)
+            self.end_headers()
+
+        def log_message(self, *args: object) -> None:
+            """Silent."""
+
+    @staticmethod
+    def serve(server: socketserver.BaseServer) -> int:
+        """Serve in background thread, return port."""
+        Thread(target=server.serve_forever, daemon=True).start()
+        return server.server_address[1]
+
+    def test_probe(self) -> None:
+        """Test parse, probe and rank."""
+        target = self.Server(("127.0.0.1", 0), self.Target)
+        proxy = self.Server(("127.0.0.1", 0), self.ConnectProxy)
+        port_target = self.serve(target)
+        port_proxy = self.serve(proxy)
+
+        # closed port for dead proxy
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            port_dead = sock.getsockname()[1]
+
+        lines = [
+            f"http://127.0.0.1:{port_proxy}",
+            f"127.0.0.1:{port_proxy}",
+            f"http://127.0.0.1:{port_dead}",
+            "bad proxy line",
+        ]
+        prober = ProxyProber(host="127.0.0.1", port=port_target, timeout=3)
+        proxies = prober.parse(lines)
+        assert len(proxies) == 2
+
+        results = list(prober.probe_many(proxies))
+        ranked = prober.rank(results)
+        assert len(results) == 2
+        assert [x.url for x in ranked] == [f"http://127.0.0.1:{port_proxy}"]
+        assert ranked[0].latency > 0
+
+        target.shutdown()
+        proxy.shutdown()